@@ -0,0 +1,61 @@
+"""
+Helpers shared by the benchmarks, which load forcegameshelper.py (or an
+older copy of it, to compare against) with a throwaway database.
+"""
+import argparse
+import importlib.util
+import os
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULE_PATH = os.path.join(ROOT, "forcegameshelper.py")
+
+
+def load_module(path=MODULE_PATH, name="forcegameshelper"):
+    """
+    Args:
+        path (str): Of forcegameshelper.py or a copy of another version,
+            e.g. `git show <commit>:forcegameshelper.py > old.py`
+        name (str)
+
+    Returns:
+        module: Loaded with a dummy token and its own database and journal
+    """
+    directory = tempfile.mkdtemp(prefix="bench-")
+    os.environ.update(TOKEN="123456:ABCDEF",
+                      DATABASE_PATH=os.path.join(directory, "bot_data.db"),
+                      JOURNAL_PATH=os.path.join(directory, "bot_data.journal"))
+    os.environ.pop("BOT_CLOUD", None)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_modules(description):
+    """
+    Parses the command line of a benchmark.
+
+    Args:
+        description (str)
+
+    Returns:
+        list of tuple[str, module]: The current module and, with --against,
+            the other version to compare it with
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--against", help="another version of forcegameshelper.py to compare with")
+    args = parser.parse_args()
+    modules = [("current", load_module())]
+    if args.against is not None:
+        modules.append(("against", load_module(args.against, "against")))
+    return modules
+
+
+def time_call(function, number):
+    """
+    Returns:
+        float: Microseconds per call of `function`, best of 7 rounds
+    """
+    return min(timeit.repeat(function, number=number, repeat=7)) / number * 1e6
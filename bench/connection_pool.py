@@ -0,0 +1,96 @@
+"""
+Throughput of Bot API calls made by parallel handlers, against a local
+server that answers every call after --latency seconds, with PTB's default
+Request and with the module's PooledRequest of several sizes.
+
+    python bench/connection_pool.py
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Bot
+from telegram.utils.request import Request
+
+from common import load_module
+
+TOKEN = "123456:ABCDEF"
+
+
+def serve(latency):
+    """
+    Returns:
+        str: Base url of a Bot API that answers every call with a message
+    """
+    body = json.dumps({"ok": True, "result": {"message_id": 1, "date": 0,
+                                              "chat": {"id": -1, "type": "channel"}}}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Answers in one segment, otherwise Nagle's algorithm delays them
+        wbufsize = 65536
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length'] or 0))
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return "http://127.0.0.1:{}/bot".format(server.server_port)
+
+
+def run(bot, threads, calls):
+    """
+    Returns:
+        float: Calls per second made by `threads` threads sending `calls` messages each
+    """
+    def send():
+        for index in range(calls):
+            bot.send_message(chat_id=-1000 - index, text="x")
+
+    workers = [threading.Thread(target=send) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return threads * calls / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--threads", type=int, default=16, help="parallel handlers")
+    parser.add_argument("--calls", type=int, default=15, help="calls per handler")
+    parser.add_argument("--latency", type=float, default=0.03, help="seconds per call")
+    args = parser.parse_args()
+    # Only the connections limit the throughput
+    os.environ.update(GLOBAL_RATE_LIMIT="100000", CHAT_RATE_LIMIT="1000000")
+    module = load_module()
+    # urllib3 warns on every throwaway connection of the default Request
+    logging.disable(logging.WARNING)
+    url = serve(args.latency)
+
+    print("{:<28} {:.0f} calls/s".format("default Request", run(
+        Bot(token=TOKEN, base_url=url), args.threads, args.calls)))
+    print("{:<28} {:.0f} calls/s".format("Request(con_pool_size=8)", run(
+        Bot(token=TOKEN, base_url=url, request=Request(con_pool_size=8)), args.threads, args.calls)))
+    for size in (4, 8, 12, 16, 20):
+        bot = module.RateLimitedBot(token=TOKEN, base_url=url, request=module.PooledRequest(con_pool_size=size))
+        print("{:<28} {:.0f} calls/s".format("PooledRequest({})".format(size), run(bot, args.threads, args.calls)))
+    print(module.metrics.get_text())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Bytes uploaded to the cloud chat in one day of backups every
+BACKUP_TIME_DIF minutes, under a posting rate given on the command line,
+against uploading the whole bot_data.json every time as before delta
+backups. The day's chain is then restored into a second store and
+compared with the first.
+
+    python bench/delta_backup.py [--channels 300] [--posts 10] [--users 5000]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from common import load_module
+from snapshot import build_bot_data
+
+
+class Document:
+    def __init__(self, file_id):
+        self.file_id = file_id
+
+
+class Sent:
+    def __init__(self, message_id, file_id):
+        self.message_id = message_id
+        self.document = Document(file_id)
+
+
+class FakeCloud:
+    def __init__(self):
+        self.files = {}
+        self.uploads = []
+
+    def send_document(self, document, filename):
+        data = document.read()
+        file_id = "file%d" % len(self.files)
+        self.files[file_id] = data
+        self.uploads.append((filename, len(data)))
+        return Sent(len(self.files), file_id)
+
+    def pin_message(self, message_id):
+        pass
+
+
+def backup(module):
+    module.backup_lock.acquire()
+    module.run_backup(None)
+
+
+def make_changes(module, bot_data, args, minutes, generator):
+    """
+    Appends the store changes of `minutes` minutes: `args.posts` posts and
+    a summary per channel and day, plus user interactions and channel
+    configuration changes.
+    """
+    day = minutes / 1440
+    channels = list(bot_data['registered_channels'].items())
+    users = list(bot_data['registered_users'].items())
+    for _ in range(round(len(channels) * args.posts * day)):
+        atusername, _ = generator.choice(channels)
+        message = module.SavedMessage(generator.randint(1, 10 ** 6), "Título de un post nuevo con algo de texto")
+        module.store.add_message(atusername, message, last=False)
+    for _ in range(round(len(channels) * day)):
+        atusername, reg_channel = generator.choice(channels)
+        reg_channel.last_summary_message_id += 1
+        module.store.save_posted_summary(atusername, reg_channel)
+    for _ in range(round(args.interactions * day)):
+        key, reg_user = generator.choice(users)
+        reg_user.status = generator.choice(["idle", "customizing"])
+        module.store.save_user(key, reg_user)
+    for _ in range(round(args.changes * day)):
+        atusername, reg_channel = generator.choice(channels)
+        reg_channel.template_format = "{titulo} nuevo"
+        module.store.save_channel(atusername, reg_channel)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--channels", type=int, default=300)
+    parser.add_argument("--messages", type=int, default=40, help="saved messages per channel at the start")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--posts", type=float, default=10, help="posts per channel and day")
+    parser.add_argument("--interactions", type=float, default=500, help="user status changes per day")
+    parser.add_argument("--changes", type=float, default=20, help="channel configuration changes per day")
+    args = parser.parse_args()
+    module = load_module()
+    cloud = module.bot_cloud = FakeCloud()
+    module.download_file = lambda file_id: cloud.files[file_id]
+
+    bot_data = build_bot_data(module, args.channels, args.messages, args.users)
+    module.store.import_tables(module.get_backup_tables(json.loads(json.dumps(bot_data, cls=module.BotDataEncoder))))
+    backup(module)
+    cloud.uploads.clear()
+    generator = random.Random(7)
+    backups = 1440 // module.BACKUP_TIME_DIF
+    for _ in range(backups):
+        make_changes(module, bot_data, args, module.BACKUP_TIME_DIF, generator)
+        backup(module)
+
+    total = sum(size for _, size in cloud.uploads)
+    bases = [size for filename, size in cloud.uploads
+             if filename not in (module.DELTA_FILENAME, module.MANIFEST_FILENAME)]
+    deltas = [size for filename, size in cloud.uploads if filename == module.DELTA_FILENAME]
+    print("{} backups: {} uploads, {:.2f} MB, {} bases of {:.0f} KB, {} deltas of {:.1f} KB on average".format(
+        backups, len(cloud.uploads), total / 1e6, len(bases), sum(bases) / max(1, len(bases)) / 1e3,
+        len(deltas), sum(deltas) / max(1, len(deltas)) / 1e3))
+    tables = module.store.read_tables()
+    full = len(json.dumps(module.build_bot_data(tables), cls=module.BotDataEncoder, indent="\t").encode())
+    print("whole bot_data.json every time: {} uploads of {:.0f} KB, {:.2f} MB".format(
+        backups, full / 1e3, backups * full / 1e6))
+
+    directory = tempfile.mkdtemp(prefix="bench-restore-")
+    manifest = cloud.files["file%d" % (len(cloud.files) - 1)]
+    module.store = module.BotStore(os.path.join(directory, "bot_data.db"),
+                                   os.path.join(directory, "bot_data.journal"), 1 << 22)
+    start = time.perf_counter()
+    module.restore_backup(manifest)
+    restored = module.store.read_tables()
+    print("restored a chain of {} deltas in {:.2f}s, same channels, users and messages: {}".format(
+        len(json.loads(manifest)['deltas']), time.perf_counter() - start,
+        restored["channels"] == tables["channels"] and restored["users"] == tables["users"] and
+        sorted(restored["messages"]) == sorted(tables["messages"])))
+
+
+if __name__ == "__main__":
+    main()
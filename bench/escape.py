@@ -0,0 +1,51 @@
+"""
+Time of escaping realistic channel text for MarkdownV2, per string: the
+module's escapers against the single-pass alternatives that were measured
+and not adopted.
+
+    python bench/escape.py [--against old_forcegameshelper.py]
+"""
+import re
+
+from common import get_modules, time_call
+
+SPECIAL = '\\[]()`>#+-=|{}.!*_~'
+TRANSLATION = str.maketrans({character: '\\' + character for character in SPECIAL})
+PATTERN = re.compile('([{}])'.format(re.escape(SPECIAL)))
+
+TEXTS = [
+    "🌀Juego: Forza Horizon 4 (2018) [Ultimate Edition] - v1.476.400.0 + 9 DLCs",
+    "🔗Partes Enviadas: 2501-3000",
+    "Shingeki no Kyojin - The Final Season (Part 2) #anime ~ 1080p_x265.mkv",
+    "=+={partes} {titulo} {partes}=+=",
+    "Resumen del dia:\n\nJuegos:\n$plantilla0$\n\nAnime:\n$plantilla1$\n\n"
+    "Se seguirá actualizando :3 (c) @Force_GamesS3!",
+    "{titulo}",
+    "{partes}",
+]
+
+
+def escape_with_translate(text):
+    return text.translate(TRANSLATION)
+
+
+def escape_with_regex(text):
+    return PATTERN.sub(r'\\\1', text)
+
+
+def main():
+    modules = get_modules(__doc__)
+    escapers = [("translate table", escape_with_translate), ("compiled regex", escape_with_regex)]
+    for label, module in modules:
+        escapers.append(("{} escape_for_telegram".format(label), module.escape_for_telegram))
+        if hasattr(module, "escape_for_telegram_cached"):
+            escapers.append(("{} escape_for_telegram_cached".format(label), module.escape_for_telegram_cached))
+    expected = [modules[0][1].escape_for_telegram(text) for text in TEXTS]
+    for label, escaper in escapers:
+        assert [escaper(text) for text in TEXTS] == expected, label
+        us = time_call(lambda: [escaper(text) for text in TEXTS], 20000) / len(TEXTS)
+        print("{:<40} {:.2f} us".format(label, us))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Appends a mix of store changes from several threads, as handlers do, then
+times reopening the store, which replays the whole journal over the
+database, for journals of 10k and 100k entries.
+
+    python bench/journal_recovery.py
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from common import load_module
+
+CHANNELS = 200
+USERS = 2000
+THREADS = 8
+
+
+def append_changes(module, store, count, seed):
+    """
+    Mostly saved messages, then user, channel and posted summary changes,
+    roughly in the proportions of a busy day.
+    """
+    generator = random.Random(seed)
+    reg_channel = module.RegisteredChannel(chat_id=-1, template="t $plantilla$", categories=["A:", "B:"])
+    reg_user = module.RegisteredUser(chat_id=1, status="idle", context_data={'channel': '@c1'})
+    for index in range(count):
+        atusername = "@c%d" % generator.randrange(CHANNELS)
+        kind = generator.random()
+        if kind < 0.8:
+            store.add_message(atusername, module.SavedMessage(index, "some title %d" % index, "A:", "Parte 1"),
+                              last=False)
+        elif kind < 0.95:
+            store.save_user(str(generator.randrange(USERS)), reg_user)
+        elif kind < 0.99:
+            store.save_channel(atusername, reg_channel)
+        else:
+            store.save_posted_summary(atusername, reg_channel)
+
+
+def run(module, entries):
+    """
+    Returns:
+        str: Summary of the run
+    """
+    directory = tempfile.mkdtemp(prefix="bench-journal-")
+    path = os.path.join(directory, "bot_data.db")
+    journal_path = os.path.join(directory, "bot_data.journal")
+    # Never compacts, so reopening replays every entry
+    store = module.BotStore(path, journal_path, 1 << 40)
+    module.metrics.counters.clear()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=append_changes, args=(module, store, entries // THREADS, seed))
+               for seed in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store.sync()
+    appended = time.perf_counter() - start
+    fsyncs = module.metrics.counters.get("journal_fsyncs", 0)
+    per_fsync = module.metrics.counters.get("journal_entries", 0) / max(1, fsyncs)
+    store.close()
+    size = os.path.getsize(journal_path)
+
+    start = time.perf_counter()
+    store = module.BotStore(path, journal_path, 1 << 40)
+    recovered = time.perf_counter() - start
+    start = time.perf_counter()
+    store.load()
+    loaded = time.perf_counter() - start
+    store.close()
+    return "{} entries ({:.1f} MB): appended from {} threads in {:.2f}s, {:.0f} entries per fsync; " \
+           "recovery {:.2f}s, load {:.2f}s".format(entries, size / 1e6, THREADS, appended, per_fsync,
+                                                  recovered, loaded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--entries", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+    module = load_module()
+    for entries in args.entries:
+        print(run(module, entries))
+
+
+if __name__ == "__main__":
+    main()
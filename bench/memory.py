@@ -0,0 +1,65 @@
+"""
+Memory per 100k saved messages, per channel and per user, measured with
+tracemalloc.
+
+    python bench/memory.py [--against old_forcegameshelper.py]
+"""
+import gc
+import random
+import tracemalloc
+
+from common import get_modules
+
+CATEGORIES = ["🎮 PC:", "🎮 PS4:", "📱 Android:", "🕹 Switch:", "💿 Xbox:"]
+CHANNELS = 1000
+MESSAGES = 100
+USERS = 20000
+
+
+def measure(build):
+    """
+    Returns:
+        int: Bytes still allocated by what `build` returned
+    """
+    random.seed(1)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = build()
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del kept
+    return sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+
+
+def build_messages(module):
+    """
+    Returns:
+        dict: Message stores, or lists before MessageStore existed, with
+            fresh strings per message like the database and json produce
+    """
+    def build_store(channel):
+        messages = [module.SavedMessage(index, "Juego número %d del canal %d" % (index, channel),
+                                        "".join(random.choice(CATEGORIES)), "📚 Partes: %d" % random.randint(1, 12))
+                    for index in range(MESSAGES)]
+        if hasattr(module, "MessageStore"):
+            return module.MessageStore(messages, categorized=True)
+        return messages
+
+    return {"@c%d" % channel: build_store(channel) for channel in range(CHANNELS)}
+
+
+def main():
+    for label, module in get_modules(__doc__):
+        messages = measure(lambda: build_messages(module))
+        channels = measure(lambda: {"@c%d" % channel: module.RegisteredChannel(
+            chat_id=channel, template="x", categories=list(CATEGORIES)) for channel in range(CHANNELS)})
+        users = measure(lambda: {str(user): module.RegisteredUser(user, "".join("idle"), {"channel": "@c1"}, ["@c1"])
+                                 for user in range(USERS)})
+        print("{}: {:.1f} MB per 100k saved messages, {} B per channel, {} B per user".format(
+            label, messages / (CHANNELS * MESSAGES) * 1e5 / 1e6, channels // CHANNELS, users // USERS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Time of get_message_data, which finds a channel post's title, category and
+parts, by number of categories of the channel.
+
+    python bench/message_data.py [--against old_forcegameshelper.py]
+"""
+from common import get_modules, time_call
+
+TEXT = """🌀Juego:  Forza Horizon 4
+🔗Partes Enviadas: 2501-3000
+⚙️Partes Totales:  6204
+🕘Vencimiento:  4am
+
+📥 Descarga el txt aquí 📥
+
+🔰Mas info sobre el juego aquí 🔰
+
+Para mas como esto visitad @Force_GamesS3 no se van a arrepentir😁🎉"""
+
+
+class Message:
+    message_id = 1
+    text = TEXT
+    caption = None
+
+
+def main():
+    modules = get_modules(__doc__)
+    for count in (0, 1, 3, 10, 30):
+        categories = ["🎴Categoria{}:".format(i) for i in range(count - 1)] + ["🌀Juego:"][:count]
+        results = []
+        for label, module in modules:
+            module.registered_channels["@canal"] = module.RegisteredChannel(
+                chat_id=1, categories=list(categories), parts_identifier="🔗Partes Enviadas:")
+            results.append((label, module.get_message_data("@canal", Message),
+                            time_call(lambda: module.get_message_data("@canal", Message), 20000)))
+        assert all(result[1] == results[0][1] for result in results)
+        print("{:>2} categories: {}".format(count, ", ".join(
+            "{} {:.2f} us".format(label, us) for label, _, us in results)))
+
+
+if __name__ == "__main__":
+    main()
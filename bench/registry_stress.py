@@ -0,0 +1,191 @@
+"""
+Stress test of the channel registry: posts to several channels while a
+thread keeps changing their categories and another keeps posting their
+summaries. Every post must end up in exactly one summary, or still be
+waiting for the next one.
+
+The Bot API is replaced by a fake one that takes --latency seconds per
+call, and the registry has a single lock stripe so every channel shares
+it; the slowest configuration change shows whether that lock is held
+while calling the Bot API.
+
+    python bench/registry_stress.py [--against old.py]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+from common import load_module
+
+CHANNELS = 8
+
+
+class Member:
+    can_post_messages = True
+    can_edit_messages = True
+
+
+class Sent:
+    def __init__(self, message_id):
+        self.message_id = message_id
+
+
+class FakeBot:
+    def __init__(self, module, latency):
+        self.module = module
+        self.latency = latency
+        self.posted = {index: [] for index in range(CHANNELS)}
+
+    def send_message(self, chat_id, text, **kwargs):
+        time.sleep(self.latency)
+        if chat_id < 0:
+            # Configuration changes re-bucket the messages, so they're read holding the lock
+            username = get_username(-1000 - chat_id)
+            with self.module.registered_channels.lock(username):
+                reg_channel = self.module.registered_channels[username]
+                self.posted[-1000 - chat_id].append([message.message_id
+                                                     for message in reg_channel.saved_messages])
+        return Sent(1)
+
+    def send_photo(self, **kwargs):
+        time.sleep(self.latency)
+        return Sent(2)
+
+    def pin_chat_message(self, *args, **kwargs):
+        time.sleep(self.latency)
+
+    def edit_message_text(self, **kwargs):
+        time.sleep(self.latency)
+
+
+class Chat:
+    def __init__(self, index):
+        self.id = -1000 - index
+        self.username = get_username(index)[1:]
+
+
+class User:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class Post:
+    def __init__(self, message_id, text):
+        self.message_id = message_id
+        self.text = text
+        self.caption = None
+
+
+class Message:
+    def __init__(self, text):
+        self.text = text
+
+    def reply_text(self, *args, **kwargs):
+        pass
+
+
+class ChannelUpdate:
+    def __init__(self, index, post):
+        self.effective_chat = Chat(index)
+        self.channel_post = post
+
+
+class PrivateUpdate:
+    def __init__(self, user_id, text):
+        self.effective_user = User(user_id)
+        self.effective_chat = User(user_id)
+        self.message = Message(text)
+
+
+def get_username(index):
+    return "@c%d" % index
+
+
+def run(module, posts, latency):
+    """
+    Returns:
+        str: Summary of the run
+    """
+    fake_bot = FakeBot(module, latency)
+    module.bot = fake_bot
+    module.get_bot_chat_member = lambda username: Member()
+    for index in range(CHANNELS):
+        module.registered_channels[get_username(index)] = module.RegisteredChannel(
+            chat_id=-1000 - index, template="x", categories=["#a"], last_summary_message_id=5)
+        reg_user = module.get_reg_user(User(index), User(index))
+        reg_user.context_data['channel'] = get_username(index)
+
+    stop = threading.Event()
+    slowest_change = [0.0]
+
+    def configure():
+        # Toggling the categories re-buckets every saved message
+        toggle = 0
+        while not stop.is_set():
+            for index in range(CHANNELS):
+                start = time.perf_counter()
+                if toggle % 2 == 0:
+                    module.remove_category(PrivateUpdate(index, "0"), None)
+                else:
+                    module.add_category(PrivateUpdate(index, "#a"), None)
+                module.change_parts_id(PrivateUpdate(index, "Parte"), None)
+                slowest_change[0] = max(slowest_change[0], time.perf_counter() - start)
+            toggle += 1
+
+    def summarize():
+        while not stop.is_set():
+            for index in range(CHANNELS):
+                module.submit_channel_work(get_username(index),
+                                           lambda username=get_username(index): module.post_summary(username))
+            time.sleep(0.005)
+
+    threads = [threading.Thread(target=configure), threading.Thread(target=summarize)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for message_id in range(posts):
+        for index in range(CHANNELS):
+            module.process_channel_update(ChannelUpdate(index, Post(message_id, "#a post %d" % message_id)), None)
+        if message_id % 50 == 0:
+            time.sleep(0.001)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    # Waits for the posts and summaries still queued
+    for promise in [module.channel_queues.submit(-1000 - index, lambda: None) for index in range(CHANNELS)]:
+        promise.result()
+    elapsed = time.perf_counter() - start
+
+    lost = duplicated = 0
+    for index in range(CHANNELS):
+        waiting = module.registered_channels[get_username(index)].saved_messages
+        seen = [message_id for batch in fake_bot.posted[index] for message_id in batch]
+        seen += [message.message_id for message in waiting]
+        lost += len(set(range(posts)) - set(seen))
+        duplicated += len(seen) - len(set(seen))
+    return "%d posts, %d summaries, lost %d, duplicated %d, slowest configuration change %.1f ms, %.2f s" % (
+        CHANNELS * posts, sum(len(batch) for batch in fake_bot.posted.values()), lost, duplicated,
+        slowest_change[0] * 1000, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--against", help="another version of forcegameshelper.py to compare with")
+    parser.add_argument("--posts", type=int, default=1500, help="posts per channel")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per fake Bot API call")
+    args = parser.parse_args()
+    os.environ.update(REGISTRY_STRIPES="1", CHANNEL_SHARDS="4", SUMMARY_EDIT_WINDOW="0")
+    # Switches threads often to expose races
+    sys.setswitchinterval(1e-5)
+    paths = [("current", None)]
+    if args.against is not None:
+        paths.append(("against", args.against))
+    for label, path in paths:
+        module = load_module() if path is None else load_module(path, label)
+        print("%s: %s" % (label, run(module, args.posts, args.latency)))
+
+
+if __name__ == "__main__":
+    main()
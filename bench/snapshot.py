@@ -0,0 +1,88 @@
+"""
+Size and load time of a backup of a synthetic dataset as the old
+pretty-printed bot_data.json, the gzipped JSON backup and the snapshot
+format with each compression.
+
+    python bench/snapshot.py
+"""
+import gzip
+import json
+import random
+import time
+
+from common import load_module
+
+SIZES = ((100, 50, 2000), (1000, 100, 20000))
+
+
+def build_bot_data(module, channels, messages, users):
+    """
+    Returns:
+        dict: In the shape of a bot_data.json backup, with `messages`
+            messages per channel
+    """
+    generator = random.Random(3)
+    registered_channels = {}
+    for index in range(channels):
+        categories = ["🎮 Juegos:", "📺 Anime:", "📚 Manga:"] if index % 3 else []
+        reg_channel = module.RegisteredChannel(
+            chat_id=-1000000000000 - index, template="Resumen\n$plantilla0$\n$plantilla1$",
+            categories=categories, parts_identifier="Parte" if index % 2 else "",
+            template_time_dif=generator.choice([12, 24]), last_summary_message_id=generator.randint(1, 10 ** 5),
+            last_summary_message_text="x" * generator.randint(0, 3000),
+            template_picture=generator.choice(["", "AgACAgEAAxkBAAIB"]))
+        for message_index in range(messages):
+            message = module.SavedMessage(generator.randint(1, 10 ** 6),
+                                          "Título del post número %d ñ 🎉" % message_index,
+                                          generator.choice(categories) if categories else "",
+                                          "Parte %d" % message_index if index % 2 else "")
+            (reg_channel.saved_messages if message_index % 2 else reg_channel.last_saved_messages).append(message)
+        registered_channels["@canal%d" % index] = reg_channel
+    registered_users = {str(index): module.RegisteredUser(
+        chat_id=index, status=generator.choice(["idle", "customizing", "categories"]),
+        context_data={'channel': "@canal%d" % (index % channels)} if index % 3 == 0 else {},
+        known_channels=["@canal%d" % (index % channels)] if index % 2 else [])
+        for index in range(users)}
+    return {'admin_id': 12345, 'registered_channels': registered_channels, 'registered_users': registered_users}
+
+
+def best_time(function, rounds=3):
+    """
+    Returns:
+        tuple: What `function` returned and its best time in seconds
+    """
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    module = load_module()
+    for channels, messages, users in SIZES:
+        text = json.dumps(build_bot_data(module, channels, messages, users), cls=module.BotDataEncoder, indent="\t")
+        tables = module.get_backup_tables(json.loads(text))
+        results = []
+
+        plain = text.encode()
+        _, load = best_time(lambda: json.loads(plain, object_hook=module.decode_bot_data))
+        results.append(("bot_data.json", len(plain), load))
+        compressed = gzip.compress(plain, compresslevel=module.BACKUP_COMPRESSION_LEVEL, mtime=0)
+        _, load = best_time(lambda: module.build_bot_data(module.decode_backup(compressed)))
+        results.append(("bot_data.json.gz", len(compressed), load))
+        for compression in module.SNAPSHOT_COMPRESSIONS:
+            data = module.encode_snapshot(tables, compression)
+            decoded, load = best_time(lambda: module.build_bot_data(module.decode_backup(data)))
+            assert json.dumps(decoded, cls=module.BotDataEncoder, indent="\t") == text, compression
+            results.append(("snapshot " + compression, len(data), load))
+
+        print("{} channels x {} messages, {} users:".format(channels, messages, users))
+        for label, size, load in results:
+            print("    {:<18} {:>10} bytes, load {:6.0f} ms".format(label, size, load * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,47 @@
 import logging
 import json
+import sys
+import zlib
+import lzma
+import gzip
+import sqlite3
 from tokenize import Token
-import telegram
 import os
-from threading import Timer
+from threading import Thread, Lock, RLock, Condition, Semaphore, Event, local
 from datetime import datetime, timedelta
 from typing import Optional
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters
-from telegram import ReplyKeyboardMarkup, Bot, TelegramError
+from io import BytesIO
+from array import array
+from math import nan, isnan
+from struct import Struct
+from functools import lru_cache, partial
+from bisect import bisect_right
+from heapq import heappush, heappop, heapify
+from collections import deque
+from random import uniform
+from contextlib import contextmanager
+from time import monotonic
+from telegram.utils.helpers import DEFAULT_NONE
+from telegram.utils.request import Request
+from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, ChatMemberHandler, TypeHandler, \
+    DispatcherHandlerStop
+from telegram.ext.utils.promise import Promise
+from telegram import ReplyKeyboardMarkup, Bot, TelegramError, Update, ChatMember
+from telegram.error import RetryAfter, Unauthorized, BadRequest, ChatMigrated
+
+
+def intern_string(value):
+    """
+    Args:
+        value (str or None)
+
+    Returns:
+        str or None: The one shared copy of `value`, so the few distinct
+            values repeated across many objects are stored once
+    """
+    if value is None:
+        return None
+    return sys.intern(value)
 
 
 class BotDataEncoder(json.JSONEncoder):
@@ -26,7 +60,8 @@ class BotDataEncoder(json.JSONEncoder):
                 'categories': obj.categories,
                 'last_summary_time': obj.last_summary_time.isoformat(),
                 'template_format': obj.template_format,
-                'parts_identifier': obj.parts_identifier
+                'parts_identifier': obj.parts_identifier,
+                'summary_edit_window': obj.summary_edit_window
             }
         elif isinstance(obj, RegisteredUser):
             return {
@@ -34,8 +69,11 @@ class BotDataEncoder(json.JSONEncoder):
                 'chat_id': obj.chat_id,
                 'status': obj.status,
                 'context_data': obj.context_data,
-                'known_channels': obj.known_channels
+                'known_channels': obj.known_channels,
+                'last_seen': obj.last_seen.isoformat() if obj.last_seen is not None else None
             }
+        elif isinstance(obj, MessageStore):
+            return list(obj)
         elif isinstance(obj, SavedMessage):
             return {
                 '__saved_message__': True,
@@ -61,13 +99,16 @@ def decode_bot_data(dct: dict):
                                      dct['last_summary_time']),
                                  last_summary_message_text=dct['last_summary_message_text'],
                                  template_format=dct['template_format'],
-                                 parts_identifier=dct['parts_identifier']
+                                 parts_identifier=dct['parts_identifier'],
+                                 summary_edit_window=dct.get('summary_edit_window')
                                  )
     elif '__reg_user__' in dct:
         return RegisteredUser(chat_id=dct['chat_id'],
                               status=dct['status'],
                               context_data=dct['context_data'],
-                              known_channels=dct['known_channels'])
+                              known_channels=dct['known_channels'],
+                              last_seen=datetime.fromisoformat(dct['last_seen'])
+                              if dct.get('last_seen') is not None else None)
     elif '__saved_message__' in dct:
         return SavedMessage(message_id=dct['id'],
                             text=dct['text'],
@@ -78,33 +119,155 @@ def decode_bot_data(dct: dict):
 
 
 class SavedMessage:
+    __slots__ = ("message_id", "text", "category", "parts", "_line", "_line_version")
+
     def __init__(self, message_id, text, category: Optional[str] = "", parts: Optional[str] = ""):
         """
         Args:
             message_id (int)
             text (str)
+            category (str): Interned, a channel only has a few of them
+            parts (str): Interned, consecutive parts of a series repeat it
         """
         self.message_id = message_id
         self.text = text
-        self.category = category
-        self.parts = parts
+        self.category = intern_string(category)
+        self.parts = intern_string(parts)
+        # Rendered summary line, valid while `_line_version` matches the
+        # owning channel's render version.
+        self._line = ""
+        self._line_version = -1
+
+
+class MessageStore:
+    __slots__ = ("categorized", "buckets", "order", "_indices", "_blocks", "_blocks_version", "_text",
+                 "_text_plan", "_text_version")
+
+    def __init__(self, messages=None, categorized=False):
+        """
+        Saved messages bucketed by category, in the order they were added.
+
+        Args:
+            messages (list of SavedMessage)
+            categorized (bool): Whether messages are bucketed by their
+                category, otherwise all of them share the "" bucket
+        """
+        self.categorized = categorized
+        self.buckets = {}
+        # Position in `buckets` of the bucket of every message in insertion
+        # order, to iterate them as one list
+        self.order = array("I")
+        self._indices = {}
+        self._blocks = None
+        self._blocks_version = -1
+        self._text = None
+        self._text_plan = None
+        self._text_version = -1
+        if messages is not None:
+            for message in messages:
+                self.append(message)
+
+    def __iter__(self):
+        iterators = [iter(bucket) for bucket in self.buckets.values()]
+        for index in self.order:
+            yield next(iterators[index])
+
+    def __len__(self):
+        return len(self.order)
+
+    def get_key(self, message):
+        """
+        Args:
+            message (SavedMessage)
+
+        Returns:
+            str: The bucket `message` belongs to
+        """
+        return message.category if self.categorized else ""
+
+    def append(self, message):
+        """
+        Args:
+            message (SavedMessage)
+        """
+        key = self.get_key(message)
+        index = self._indices.get(key)
+        if index is not None:
+            self.buckets[key].append(message)
+        else:
+            index = self._indices[key] = len(self.buckets)
+            self.buckets[key] = [message]
+        self.order.append(index)
+        self._text = None
+
+    def set_categorized(self, categorized):
+        """
+        Re-buckets the messages if the channel started or stopped using categories.
+
+        Args:
+            categorized (bool)
+        """
+        if categorized != self.categorized:
+            messages = list(self)
+            self.categorized = categorized
+            self.rebuild(messages)
+
+    def keep_last(self, count):
+        """
+        Drops the oldest messages so that at most `count` are left.
+
+        Args:
+            count (int)
+
+        Returns:
+            list of SavedMessage: The messages dropped
+        """
+        messages = list(self)
+        if len(messages) <= count:
+            return []
+        self.rebuild(messages[len(messages) - count:])
+        return messages[:len(messages) - count]
+
+    def rebuild(self, messages):
+        """
+        Args:
+            messages (list of SavedMessage): Replace the stored ones
+        """
+        self.buckets = {}
+        self.order = array("I")
+        self._indices = {}
+        self._blocks = None
+        self._text = None
+        for message in messages:
+            self.append(message)
 
 
 class RegisteredChannel:
+    __slots__ = ("chat_id", "template", "template_picture", "template_time_dif", "last_summary_message_id",
+                 "last_summary_message_text", "template_format", "parts_identifier", "summary_edit_window",
+                 "categories", "last_summary_time", "_message_loader", "_message_lock", "_saved_messages",
+                 "_last_saved_messages", "_render_version", "_template_plan", "_matcher", "_post_to_pin")
+
     def __init__(self, chat_id=0, template="", template_picture="", template_time_dif=24, saved_messages=None,
                  last_saved_messages=None, last_summary_message_id=-1, categories=None, last_summary_time=None,
-                 last_summary_message_text="", template_format="", parts_identifier=""):
+                 last_summary_message_text="", template_format="", parts_identifier="",
+                 summary_edit_window=None, message_loader=None):
         """
         Args:
             chat_id (int)
             template (str)
             template_picture (str)
             template_time_dif (int)
-            saved_messages (list of SavedMessage)
-            last_saved_messages (list of SavedMessage)
+            saved_messages (list of SavedMessage or MessageStore)
+            last_saved_messages (list of SavedMessage or MessageStore)
             last_summary_message_id (int)
             categories (list of str)
             last_summary_time (datetime)
+            summary_edit_window (float): Seconds during which edits to the last
+                summary are coalesced, None to use SUMMARY_EDIT_WINDOW
+            message_loader (callable): Returns the saved messages and the last
+                saved messages the first time either is used, instead of
+                passing them in
         """
         self.chat_id = chat_id
         self.template = template
@@ -114,47 +277,1901 @@ class RegisteredChannel:
         self.last_summary_message_text = last_summary_message_text
         self.template_format = template_format
         self.parts_identifier = parts_identifier
-        if saved_messages is not None:
-            self.saved_messages = saved_messages
+        self.summary_edit_window = summary_edit_window
+        if categories is not None:
+            self.categories = [intern_string(category) for category in categories]
+        else:
+            self.categories = []
+        self._message_loader = message_loader
+        self._message_lock = Lock()
+        if isinstance(saved_messages, MessageStore):
+            self._saved_messages = saved_messages
         else:
-            self.saved_messages = []
-        if last_saved_messages is not None:
-            self.last_saved_messages = last_saved_messages
+            self._saved_messages = MessageStore(saved_messages, categorized=len(self.categories) > 0)
+        if isinstance(last_saved_messages, MessageStore):
+            self._last_saved_messages = last_saved_messages
         else:
-            self.last_saved_messages = []
+            self._last_saved_messages = MessageStore(last_saved_messages, categorized=len(self.categories) > 0)
         if last_summary_time is not None:
             self.last_summary_time = last_summary_time
         else:
             self.last_summary_time = datetime.now()
-        if categories is not None:
-            self.categories = categories
+        self._render_version = 0
+        self._template_plan = None
+        self._matcher = None
+        # Seconds the last summary this run posted took to be sent and pinned
+        self._post_to_pin = None
+
+    @property
+    def saved_messages(self):
+        """
+        MessageStore: Messages for the next summary
+        """
+        if self._message_loader is not None:
+            self.load_messages()
+        return self._saved_messages
+
+    @saved_messages.setter
+    def saved_messages(self, messages):
+        self.load_messages()
+        self._saved_messages = messages
+
+    @property
+    def last_saved_messages(self):
+        """
+        MessageStore: Messages in the last summary posted
+        """
+        if self._message_loader is not None:
+            self.load_messages()
+        return self._last_saved_messages
+
+    @last_saved_messages.setter
+    def last_saved_messages(self, messages):
+        self.load_messages()
+        self._last_saved_messages = messages
+
+    def load_messages(self):
+        """
+        Materializes the messages of a channel created with a `message_loader`.
+        """
+        with self._message_lock:
+            if self._message_loader is None:
+                return
+            saved_messages, last_saved_messages = self._message_loader()
+            self._saved_messages = MessageStore(saved_messages, categorized=len(self.categories) > 0)
+            self._last_saved_messages = MessageStore(last_saved_messages,
+                                                     categorized=len(self.categories) > 0)
+            self._message_loader = None
+
+    def invalidate_render_cache(self):
+        """
+        Discards every cached summary line and category block, must be called
+        whenever something that affects how a message is rendered changes.
+        """
+        self._render_version += 1
+
+    def invalidate_template_plan(self):
+        """
+        Discards the compiled template, must be called whenever the template
+        or the categories change.
+        """
+        self._template_plan = None
+
+    def invalidate_matcher(self):
+        """
+        Discards the category and parts matcher, must be called whenever
+        categories are added or removed, or the parts identifier changes.
+        """
+        self._matcher = None
+
+    def update_message_buckets(self):
+        """
+        Must be called whenever categories are added or removed.
+        """
+        self.saved_messages.set_categorized(len(self.categories) > 0)
+        self.last_saved_messages.set_categorized(len(self.categories) > 0)
+
+
+class PatternMatcher:
+    def __init__(self, patterns):
+        """
+        Finds the first line of a message that contains each of several
+        identifiers with one `str.find` over the whole message per
+        identifier, instead of testing every line for every identifier.
+        Only pays off with PATTERN_MATCHER_MIN_CATEGORIES categories or more.
+
+        Args:
+            patterns (list of str)
+        """
+        # An identifier spanning a line break can never be inside a single line
+        self.patterns = [pattern for pattern in dict.fromkeys(patterns)
+                         if pattern == "" or pattern.splitlines() == [pattern]]
+
+    def find_first_lines(self, text, lines):
+        """
+        Args:
+            text (str)
+            lines (list of str): `text.splitlines()`
+
+        Returns:
+            dict[str, int]: The index in `lines` of the first line that
+                contains each pattern, patterns that were not found are
+                left out
+        """
+        positions = {}
+        for pattern in self.patterns:
+            position = text.find(pattern)
+            if position != -1:
+                positions[pattern] = position
+        if len(positions) == 0 or text == "":
+            return {}
+
+        line_ends = []
+        end = 0
+        for line in lines:
+            # Every line break is a single character except "\r\n"
+            end += len(line) + (2 if text.startswith("\r\n", end + len(line)) else 1)
+            line_ends.append(end)
+        return {pattern: bisect_right(line_ends, position)
+                for pattern, position in positions.items()}
+
+
+class TemplateSlot:
+    def __init__(self, key):
+        """
+        A placeholder in a compiled template that is filled with a category block.
+
+        Args:
+            key (str): Category whose block fills this slot, "" for
+                channels without categories
+        """
+        self.key = key
+
+
+class RegisteredUser:
+    __slots__ = ("chat_id", "status", "context_data", "known_channels", "last_seen")
+
+    def __init__(self, chat_id=0, status="", context_data=None, known_channels=None, last_seen=None):
+        """
+        Args:
+            chat_id (int)
+            status (str)
+            context_data (dict[str, str])
+            known_channels (list of str)
+            last_seen (datetime): Last time the user sent an update, None if
+                it was never recorded
+        """
+        self.chat_id = chat_id
+        self.status = intern_string(status)
+        self.last_seen = last_seen
+        if context_data is not None:
+            self.context_data = context_data
         else:
-            self.categories = []
+            self.context_data = {}
+        if known_channels is not None:
+            self.known_channels = known_channels
+        else:
+            self.known_channels = []
+
+
+class Registry:
+    def __init__(self, stripes):
+        """
+        Registered channels or users by key, shared by the dispatcher, the
+        channel shards and the scheduler's workers.
+
+        Lookups read the dict without locking, writes are serialized, and
+        iterating goes over a copy so entries can be added or removed
+        meanwhile. Changes to an entry are made holding its `lock`.
+
+        Args:
+            stripes (int): Number of locks the keys are spread over
+        """
+        self.items_by_key = {}
+        self.write_lock = Lock()
+        self.stripes = [RLock() for _ in range(stripes)]
+
+    def __contains__(self, key):
+        return key in self.items_by_key
+
+    def __getitem__(self, key):
+        return self.items_by_key[key]
+
+    def __setitem__(self, key, value):
+        with self.write_lock:
+            self.items_by_key[key] = value
+
+    def __len__(self):
+        return len(self.items_by_key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, key, default=None):
+        return self.items_by_key.get(key, default)
+
+    def setdefault(self, key, default):
+        """
+        Returns:
+            The entry of `key`, `default` after adding it if there was none
+        """
+        value = self.items_by_key.get(key)
+        if value is not None:
+            return value
+        with self.write_lock:
+            return self.items_by_key.setdefault(key, default)
+
+    def pop(self, key, default=None):
+        with self.write_lock:
+            return self.items_by_key.pop(key, default)
+
+    def keys(self):
+        """
+        Returns:
+            list: Snapshot of the keys
+        """
+        with self.write_lock:
+            return list(self.items_by_key)
+
+    def values(self):
+        """
+        Returns:
+            list: Snapshot of the entries
+        """
+        with self.write_lock:
+            return list(self.items_by_key.values())
+
+    def items(self):
+        """
+        Returns:
+            list of tuple: Snapshot of the keys and their entries
+        """
+        with self.write_lock:
+            return list(self.items_by_key.items())
+
+    def replace(self, items_by_key):
+        """
+        Swaps every entry at once, readers see either the old entries or the
+        new ones.
+
+        Args:
+            items_by_key (dict)
+        """
+        with self.write_lock:
+            self.items_by_key = dict(items_by_key)
+
+    def lock(self, key):
+        """
+        Args:
+            key (str)
+
+        Returns:
+            threading.RLock: Held while changing the entry of `key`, other
+                keys share it so a thread never holds two locks of a registry,
+                and takes a user's lock before a channel's
+        """
+        return self.stripes[hash(key) % len(self.stripes)]
+
+
+class Metrics:
+    def __init__(self):
+        """
+        Thread safe counters and timings shown in /stats.
+        """
+        self.lock = Lock()
+        self.counters = {}
+        self.timings = {}
+
+    def increment(self, name, value=1):
+        """
+        Args:
+            name (str)
+            value (int)
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        """
+        Args:
+            name (str)
+            value (int or float)
+        """
+        with self.lock:
+            self.counters[name] = value
+
+    def observe(self, name, value):
+        """
+        Args:
+            name (str)
+            value (float): A duration in seconds or a size
+        """
+        with self.lock:
+            count, total, maximum = self.timings.get(name, (0, 0.0, 0.0))
+            self.timings[name] = (count + 1, total + value, max(maximum, value))
+
+    def get_text(self):
+        """
+        Returns:
+            str: Every counter and timing, one per line
+        """
+        with self.lock:
+            lines = ["{}: {}".format(name, value)
+                     for name, value in sorted(self.counters.items())]
+            lines += ["{}: n={} avg={:.3f} max={:.3f}".format(name, count, total / count, maximum)
+                      for name, (count, total, maximum) in sorted(self.timings.items())]
+        return "\n".join(lines)
+
+
+class ScheduledJob:
+    def __init__(self, key, name, function, due, interval=None, jitter=0.0, timeout=None, dropped=None):
+        """
+        Args:
+            key (str): Identifies the job in its scheduler
+            name (str): Prefix of the job's metrics, shared by jobs of a kind
+            function (callable): Called without arguments
+            due (float): `monotonic` time of the next run
+            interval (float): Seconds between runs, None to run once
+            jitter (float): Fraction of `interval` each run is randomly moved by
+            timeout (float): Seconds after which a run is reported and
+                abandoned, None to wait for it
+            dropped (callable): Called without arguments instead of
+                `function` when a one-off job is cancelled, replaced or
+                the scheduler stops before it runs
+        """
+        self.key = key
+        self.name = name
+        self.function = function
+        self.dropped = dropped
+        self.due = due
+        self.interval = interval
+        self.jitter = jitter
+        self.timeout = timeout
+        # Heap entry that is current, older entries for the job are skipped
+        self.sequence = 0
+
+
+class JobScheduler:
+    def __init__(self, workers):
+        """
+        Runs periodic and one-off jobs on a pool of worker threads, from a
+        single thread that sleeps until the earliest one is due.
+
+        A job never overlaps itself: a periodic run is skipped while the
+        previous one is still going, and a one-off job is retried shortly.
+        A run past its job's timeout is reported and its worker replaced,
+        but the job doesn't run again until it returns.
+        Rescheduling a job pushes a new heap entry and leaves the old one
+        to be skipped, so it costs O(log n).
+
+        Args:
+            workers (int)
+        """
+        self.condition = Condition()
+        self.heap = []
+        self.jobs: dict[str, ScheduledJob] = {}
+        # Sequence number of the run of every job that is queued or running
+        self.running: dict[str, int] = {}
+        # Heap of when each run with a timeout started on a worker times out
+        self.deadlines = []
+        # Sequence numbers of the runs that timed out
+        self.timed_out = set()
+        self.ready = deque()
+        self.sequence = 0
+        self.stopped = False
+        self.workers = 0
+        for _ in range(workers):
+            self.add_worker()
+        Thread(target=self.run, name="scheduler", daemon=True).start()
+
+    def every(self, name, interval, function, jitter=0.0, timeout=None, delay=None):
+        """
+        Args:
+            name (str): Also the job's key
+            interval (float): Seconds
+            function (callable)
+            jitter (float): Fraction of `interval`
+            timeout (float): Seconds
+            delay (float): Seconds until the first run, defaults to an interval
+        """
+        with self.condition:
+            job = ScheduledJob(name, name, function, 0.0, interval, jitter, timeout)
+            self.jobs[name] = job
+            self.push(job, monotonic() + (self.get_interval(job) if delay is None else delay))
+
+    def schedule(self, key, delay, function, name=None, timeout=None, dropped=None):
+        """
+        Runs `function` once, replacing the job already scheduled with `key`.
+
+        Args:
+            key (str)
+            delay (float): Seconds from now
+            function (callable)
+            name (str): Defaults to `key`
+            timeout (float): Seconds
+            dropped (callable): Called instead of `function` if the job never runs
+        """
+        with self.condition:
+            job = ScheduledJob(key, name or key, function, 0.0, timeout=timeout, dropped=dropped)
+            replaced = self.jobs.get(key)
+            self.jobs[key] = job
+            self.push(job, monotonic() + max(0.0, delay))
+        self.drop([replaced])
+
+    def cancel(self, key):
+        """
+        Args:
+            key (str): Of a job that may have already run or not exist
+        """
+        with self.condition:
+            cancelled = self.jobs.pop(key, None)
+        self.drop([cancelled])
+
+    def is_scheduled(self, key):
+        with self.condition:
+            return key in self.jobs
+
+    def stop(self):
+        """
+        Stops running jobs, the ones that are scheduled or queued for a
+        worker are dropped.
+        """
+        with self.condition:
+            self.stopped = True
+            pending = list(self.jobs.values()) + [job for job, _ in self.ready]
+            self.ready.clear()
+            self.condition.notify_all()
+        self.drop(pending)
+
+    @staticmethod
+    def drop(jobs):
+        """
+        Must be called without holding `condition`.
+
+        Args:
+            jobs (list of ScheduledJob): That won't run, or None
+        """
+        for job in jobs:
+            if job is not None and job.interval is None and job.dropped is not None:
+                try:
+                    job.dropped()
+                except Exception:
+                    logger.exception("Dropping job %s failed", job.key)
+
+    def push(self, job, due):
+        """
+        Must be called while holding `condition`.
+
+        Args:
+            job (ScheduledJob)
+            due (float)
+        """
+        self.sequence += 1
+        job.due = due
+        job.sequence = self.sequence
+        heappush(self.heap, (due, self.sequence, job.key))
+        # Entries of cancelled and rescheduled jobs pile up until they're due
+        if len(self.heap) > 2 * len(self.jobs) + 64:
+            self.heap = [(job.due, job.sequence, key) for key, job in self.jobs.items()]
+            heapify(self.heap)
+        metrics.set("scheduler_jobs", len(self.jobs))
+        self.condition.notify_all()
+
+    @staticmethod
+    def get_interval(job):
+        """
+        Args:
+            job (ScheduledJob): Periodic
+
+        Returns:
+            float: Seconds until the job's next run
+        """
+        return job.interval * (1 + uniform(-job.jitter, job.jitter))
+
+    def run(self):
+        with self.condition:
+            while not self.stopped:
+                now = monotonic()
+                wait = self.check_timeouts(now)
+                if len(self.heap) > 0:
+                    due, sequence, key = self.heap[0]
+                    job = self.jobs.get(key)
+                    if job is None or job.sequence != sequence:
+                        heappop(self.heap)
+                        continue
+                    if due <= now:
+                        heappop(self.heap)
+                        self.dispatch(job, now)
+                        continue
+                    wait = due - now if wait is None else min(wait, due - now)
+                self.condition.wait(wait)
+
+    def dispatch(self, job, now):
+        """
+        Must be called while holding `condition`.
+
+        Args:
+            job (ScheduledJob): Due
+            now (float)
+        """
+        if job.key in self.running:
+            metrics.increment("job_{}_overlaps".format(job.name))
+            if job.interval is None:
+                self.push(job, now + 1.0)
+        else:
+            self.sequence += 1
+            self.running[job.key] = self.sequence
+            self.ready.append((job, self.sequence))
+            if job.interval is None:
+                del self.jobs[job.key]
+        if job.interval is not None:
+            # A late run doesn't make the next ones catch up
+            self.push(job, max(job.due + self.get_interval(job), now + job.interval * (1 - job.jitter)))
+        metrics.set("scheduler_jobs", len(self.jobs))
+        self.condition.notify_all()
+
+    def check_timeouts(self, now):
+        """
+        Must be called while holding `condition`.
+
+        Args:
+            now (float)
+
+        Returns:
+            float: Seconds until the next running job times out, None if
+                none of them can
+        """
+        while len(self.deadlines) > 0 and self.deadlines[0][0] <= now:
+            deadline, sequence, job = heappop(self.deadlines)
+            if self.running.get(job.key) == sequence:
+                # A thread can't be interrupted, the stuck run is left behind
+                # and its worker replaced so the other jobs keep running
+                logger.warning("Job %s timed out after %.1fs", job.key, job.timeout)
+                metrics.increment("job_{}_timeouts".format(job.name))
+                self.timed_out.add(sequence)
+                self.add_worker()
+        return self.deadlines[0][0] - now if len(self.deadlines) > 0 else None
+
+    def add_worker(self):
+        self.workers += 1
+        Thread(target=self.work, name="scheduler-worker", daemon=True).start()
+
+    def work(self):
+        while True:
+            with self.condition:
+                while len(self.ready) == 0 and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                job, sequence = self.ready.popleft()
+                start = monotonic()
+                if job.timeout is not None:
+                    heappush(self.deadlines, (start + job.timeout, sequence, job))
+                    self.condition.notify_all()
+            try:
+                job.function()
+            except Exception:
+                metrics.increment("job_{}_failures".format(job.name))
+                logger.exception("Job %s failed", job.key)
+            metrics.observe("job_" + job.name, monotonic() - start)
+            with self.condition:
+                del self.running[job.key]
+                self.condition.notify_all()
+                if sequence in self.timed_out:
+                    # Another worker replaced this one
+                    self.timed_out.discard(sequence)
+                    self.workers -= 1
+                    return
+
+    def get_text(self):
+        """
+        Returns:
+            str: When each periodic job runs next, one per line
+        """
+        now = monotonic()
+        with self.condition:
+            return "\n".join("{}: next in {:.0f}s{}".format(
+                key, job.due - now, ", running" if key in self.running else "")
+                for key, job in sorted(self.jobs.items()) if job.interval is not None)
+
+
+class ChannelShard:
+    def __init__(self, index):
+        """
+        Worker thread that runs the work of its channels, each channel's in
+        the order it was submitted, taking turns between channels.
+
+        Args:
+            index (int): Suffix of the shard's metrics
+        """
+        self.index = index
+        self.condition = Condition()
+        self.queues: dict[int, deque] = {}
+        # Channels with queued work, in the order they're served
+        self.active = deque()
+        self.depth = 0
+        Thread(target=self.work, name="channel-shard-{}".format(index), daemon=True).start()
+
+    def submit(self, chat_id, function):
+        """
+        Args:
+            chat_id (int)
+            function (callable): Called without arguments
+
+        Returns:
+            telegram.ext.utils.promise.Promise: Of `function`
+        """
+        promise = Promise(function, (), {})
+        with self.condition:
+            queue = self.queues.get(chat_id)
+            if queue is None:
+                queue = self.queues[chat_id] = deque()
+                self.active.append(chat_id)
+            queue.append((promise, monotonic()))
+            self.depth += 1
+            metrics.set("channel_shard_{}_depth".format(self.index), self.depth)
+            self.condition.notify()
+        return promise
+
+    def work(self):
+        while True:
+            with self.condition:
+                while len(self.active) == 0:
+                    self.condition.wait()
+                chat_id = self.active.popleft()
+                queue = self.queues[chat_id]
+                promise, submitted = queue.popleft()
+                if len(queue) > 0:
+                    self.active.append(chat_id)
+                else:
+                    del self.queues[chat_id]
+                self.depth -= 1
+                metrics.set("channel_shard_{}_depth".format(self.index), self.depth)
+            metrics.observe("channel_shard_{}_lag".format(self.index), monotonic() - submitted)
+            promise.run()
+            if promise.exception is not None:
+                metrics.increment("channel_work_failures")
+                logger.error("Work for channel %s failed", chat_id, exc_info=promise.exception)
+
+
+class ChannelQueues:
+    def __init__(self, shards):
+        """
+        Runs the work of each channel strictly in order, on the shard its
+        chat id maps to, while different channels run in parallel.
+
+        Args:
+            shards (int)
+        """
+        self.shards = [ChannelShard(index) for index in range(shards)]
+
+    def submit(self, chat_id, function):
+        """
+        Args:
+            chat_id (int)
+            function (callable): Runs after the work already submitted for
+                the channel
+
+        Returns:
+            telegram.ext.utils.promise.Promise: Of `function`
+        """
+        return self.shards[chat_id % len(self.shards)].submit(chat_id, function)
+
+
+class Broadcast:
+    def __init__(self, text, keys, created, position=0, sent=0, failed=0, dead=None, elapsed=0.0):
+        """
+        Message sent to registered users in the background by a pool of
+        threads, whose progress is saved to resume it after a restart.
+
+        Args:
+            text (str)
+            keys (list of str): Of the registered users it is sent to
+            created (datetime)
+            position (int): The users before it in `keys` were already sent to
+            sent (int)
+            failed (int)
+            dead (list of str): Keys of the users whose chats are gone, they
+                are forgotten once the broadcast ends
+            elapsed (float): Seconds spent sending before the last restart
+        """
+        self.text = text
+        self.keys = keys
+        self.created = created
+        self.position = position
+        self.sent = sent
+        self.failed = failed
+        self.dead = dead if dead is not None else []
+        self.elapsed = elapsed
+        self.started = monotonic()
+        self.lock = Lock()
+        # Held while saving the progress, so an older one never overwrites it
+        self.save_lock = Lock()
+        # Positions past `position` that were already sent to, workers
+        # finish out of order
+        self.finished = set()
+        self.next = position
+        self.saved_position = position
+
+    def take(self):
+        """
+        Returns:
+            int: Position in `keys` of the next user to send to, None if
+                every user was taken
+        """
+        with self.lock:
+            if self.next >= len(self.keys):
+                return None
+            self.next += 1
+            return self.next - 1
+
+    def finish(self, index, outcome):
+        """
+        Args:
+            index (int): Returned by `take`
+            outcome (str): "sent", "failed", "dead" or None if the user
+                was forgotten meanwhile
+
+        Returns:
+            bool: Whether enough users were sent to since the last
+                checkpoint to save the progress
+        """
+        with self.lock:
+            if outcome == "sent":
+                self.sent += 1
+            elif outcome == "failed":
+                self.failed += 1
+            elif outcome == "dead":
+                self.dead.append(self.keys[index])
+            self.finished.add(index)
+            while self.position in self.finished:
+                self.finished.remove(self.position)
+                self.position += 1
+            if self.position - self.saved_position >= BROADCAST_CHECKPOINT_SIZE:
+                self.saved_position = self.position
+                return True
+            return False
+
+    def get_elapsed(self):
+        """
+        Returns:
+            float: Seconds spent sending, across restarts
+        """
+        return self.elapsed + monotonic() - self.started
+
+    def get_progress(self):
+        """
+        Returns:
+            dict: Saved as the broadcast_progress setting, a restart sends
+                again to the users that finished out of order after `position`
+        """
+        with self.lock:
+            return {"position": self.position, "sent": self.sent, "failed": self.failed,
+                    "dead": list(self.dead), "elapsed": self.get_elapsed()}
+
+    def save_progress(self):
+        with self.save_lock:
+            store.set_local_setting("broadcast_progress", self.get_progress())
+
+    def get_text(self):
+        with self.lock:
+            return "Broadcast: {}/{} users, {} sent, {} failed, {} dead chats".format(
+                self.position, len(self.keys), self.sent, self.failed, len(self.dead))
+
+
+class SummaryEditCoalescer:
+    def __init__(self):
+        """
+        Collapses the edits to a channel's last summary that are requested
+        within its edit window into a single edit with the latest render.
+        """
+        self.lock = Lock()
+        self.pending: set[str] = set()
+
+    def mark_dirty(self, atusername, delay=None):
+        """
+        Args:
+            atusername (str)
+            delay (float): Seconds to wait before editing, defaults to the
+                channel's edit window
+        """
+        metrics.increment("summary_edits_requested")
+        if delay is None:
+            reg_channel = registered_channels.get(atusername)
+            if reg_channel is None:
+                return
+            delay = get_summary_edit_window(reg_channel)
+        if delay <= 0:
+            self.flush(atusername)
+            return
+        with self.lock:
+            if atusername in self.pending:
+                metrics.increment("summary_edits_saved")
+                return
+            self.pending.add(atusername)
+        scheduler.schedule("summary_edit:" + atusername, delay, partial(self.submit, atusername),
+                           name="summary_edit", dropped=partial(self.discard, atusername))
+
+    def submit(self, atusername):
+        """
+        Queues the edit on the channel's queue once its window is over.
+
+        Args:
+            atusername (str)
+        """
+        if submit_channel_work(atusername, partial(self.flush, atusername)) is None:
+            # Unregistered meanwhile, a channel registered again under the
+            # same name must not find its edits already pending
+            self.discard(atusername)
+
+    def discard(self, atusername):
+        """
+        Args:
+            atusername (str)
+        """
+        with self.lock:
+            self.pending.discard(atusername)
+
+    def flush(self, atusername):
+        """
+        Args:
+            atusername (str)
+        """
+        self.discard(atusername)
+        try:
+            with outbound_priority(PRIORITY_SUMMARY):
+                edit_last_summary(atusername)
+        except Exception as e:
+            logger.error("Couldn't edit last summary of %s: %s", atusername, e)
+
+
+class TTLCache:
+    def __init__(self, name, ttl):
+        """
+        Thread safe cache whose entries expire `ttl` seconds after being loaded.
+
+        Args:
+            name (str): Prefix of the hit and miss counters in the metrics
+            ttl (float)
+        """
+        self.name = name
+        self.ttl = ttl
+        self.lock = Lock()
+        self.entries = {}
+
+    def get(self, key, loader):
+        """
+        Args:
+            key
+            loader (callable): Called without arguments to load the value
+                of `key` when it isn't cached
+
+        Returns:
+            The cached or freshly loaded value of `key`
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and entry[1] > monotonic():
+            metrics.increment(self.name + "_hits")
+            return entry[0]
+        metrics.increment(self.name + "_misses")
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def get_cached(self, key):
+        """
+        Args:
+            key
+
+        Returns:
+            The cached value of `key`, None if it isn't cached
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and entry[1] > monotonic():
+            return entry[0]
+        return None
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, monotonic() + self.ttl)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def purge(self):
+        """
+        Drops the expired entries, which are otherwise only replaced when
+        their key is used again.
+        """
+        now = monotonic()
+        with self.lock:
+            self.entries = {key: entry for key, entry in self.entries.items() if entry[1] > now}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        """
+        Args:
+            rate (float): Tokens added per second
+            capacity (float): Maximum amount of tokens
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self):
+        """
+        Takes a token if there is one available.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds until one is available
+        """
+        now = monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self):
+        return self.tokens + (monotonic() - self.updated) * self.rate >= self.capacity
+
+
+class OutboundLimiter:
+    def __init__(self, global_rate, chat_rate, chat_capacity, private_rate, private_capacity):
+        """
+        Schedules the Bot API calls under Telegram's global and per chat
+        limits, the global tokens are handed out by priority. Groups and
+        channels have a per minute budget, private chats a per second one.
+
+        Args:
+            global_rate (float): Calls per second across all chats
+            chat_rate (float): Calls per second to a single group or channel
+            chat_capacity (float): Calls that can be sent to a group or channel in a burst
+            private_rate (float): Calls per second to a single private chat
+            private_capacity (float): Calls that can be sent to a private chat in a burst
+        """
+        self.condition = Condition()
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_capacity = chat_capacity
+        self.private_rate = private_rate
+        self.private_capacity = private_capacity
+        self.chat_buckets: dict[int | str, TokenBucket] = {}
+        self.waiting = []
+        self.sequence = 0
+
+    def acquire(self, chat_id, priority):
+        """
+        Blocks until a call to `chat_id` can be made.
+
+        Args:
+            chat_id (int | str): Key from `get_limiter_key`, None for calls that
+                don't count towards a chat's limit
+            priority (int): Lower values are served first
+        """
+        start = monotonic()
+        with self.condition:
+            if chat_id is not None:
+                while True:
+                    wait = self.get_chat_bucket(chat_id).reserve()
+                    if wait == 0:
+                        break
+                    self.condition.wait(wait)
+
+            self.sequence += 1
+            ticket = (priority, self.sequence)
+            heappush(self.waiting, ticket)
+            metrics.set("outbound_queue_depth", len(self.waiting))
+            while True:
+                if self.waiting[0] == ticket:
+                    wait = self.global_bucket.reserve()
+                    if wait == 0:
+                        heappop(self.waiting)
+                        metrics.set("outbound_queue_depth", len(self.waiting))
+                        self.condition.notify_all()
+                        break
+                    self.condition.wait(wait)
+                else:
+                    self.condition.wait()
+        metrics.observe("outbound_wait", monotonic() - start)
+
+    def pause(self, chat_id, seconds):
+        """
+        Holds back the calls to `chat_id`, or every call if it is None, after
+        Telegram asked to retry later.
+
+        Args:
+            chat_id (int | str): Key from `get_limiter_key`
+            seconds (float)
+        """
+        with self.condition:
+            if chat_id is not None:
+                bucket = self.get_chat_bucket(chat_id)
+            else:
+                bucket = self.global_bucket
+            bucket.paused_until = max(bucket.paused_until, monotonic() + seconds)
+            self.condition.notify_all()
+
+    def get_chat_bucket(self, chat_id):
+        """
+        Must be called while holding `condition`.
+
+        Args:
+            chat_id (int | str): Key from `get_limiter_key`
+
+        Returns:
+            TokenBucket
+        """
+        if chat_id not in self.chat_buckets:
+            if len(self.chat_buckets) >= MAX_CHAT_BUCKETS:
+                self.chat_buckets = {key: bucket for key, bucket in self.chat_buckets.items()
+                                     if not bucket.is_full()}
+            # Users have positive ids, groups and channels negative ones or a @username
+            if isinstance(chat_id, int) and chat_id > 0:
+                self.chat_buckets[chat_id] = TokenBucket(self.private_rate, self.private_capacity)
+            else:
+                self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_capacity)
+        return self.chat_buckets[chat_id]
+
+
+class PooledRequest(Request):
+    # PTB warns about attributes outside of __slots__
+    __slots__ = ('slots', 'in_use_lock', 'in_use')
+
+    def __init__(self, con_pool_size, **kwargs):
+        """
+        Request whose callers queue for one of the pooled connections instead of
+        opening throwaway ones when the pool is exhausted.
+
+        Args:
+            con_pool_size (int)
+            kwargs: Passed to `telegram.utils.request.Request`
+        """
+        super().__init__(con_pool_size=con_pool_size, **kwargs)
+        self.slots = Semaphore(con_pool_size)
+        self.in_use_lock = Lock()
+        self.in_use = 0
+
+    def _request_wrapper(self, *args, **kwargs):
+        start = monotonic()
+        if not self.slots.acquire(blocking=False):
+            metrics.increment("http_pool_saturated")
+            self.slots.acquire()
+        metrics.observe("http_pool_wait", monotonic() - start)
+        with self.in_use_lock:
+            self.in_use += 1
+            metrics.set("http_pool_in_use", self.in_use)
+        try:
+            return super()._request_wrapper(*args, **kwargs)
+        finally:
+            with self.in_use_lock:
+                self.in_use -= 1
+                metrics.set("http_pool_in_use", self.in_use)
+            self.slots.release()
+            metrics.observe("http_request", monotonic() - start)
+
+
+class RateLimitedBot(Bot):
+    # Every Bot API method ends up in _post, so all calls wait for the limiter
+    # here and are retried when Telegram answers with RetryAfter.
+    def _post(self, endpoint, data=None, timeout=DEFAULT_NONE, api_kwargs=None):
+        chat_id = None
+        if endpoint in CHAT_LIMITED_ENDPOINTS:
+            chat_id = get_limiter_key((data or {}).get('chat_id', (api_kwargs or {}).get('chat_id')))
+        for attempt in range(RETRY_AFTER_ATTEMPTS):
+            outbound_limiter.acquire(chat_id, get_outbound_priority())
+            try:
+                return super()._post(endpoint, data, timeout, api_kwargs)
+            except RetryAfter as e:
+                metrics.increment("outbound_retry_after")
+                if attempt == RETRY_AFTER_ATTEMPTS - 1:
+                    raise
+                outbound_limiter.pause(chat_id, e.retry_after)
+
+
+def get_limiter_key(chat_id):
+    """
+    Args:
+        chat_id (int | str | None): Numeric id or @username the call is sent to
+
+    Returns:
+        int | str | None: The same key for a registered channel whether it is
+            addressed by id or by username
+    """
+    if isinstance(chat_id, str):
+        if chat_id.startswith("@"):
+            reg_channel = registered_channels.get(chat_id.lower())
+            return reg_channel.chat_id if reg_channel is not None and reg_channel.chat_id else chat_id.lower()
+        try:
+            return int(chat_id)
+        except ValueError:
+            return chat_id
+    return chat_id
+
+
+class SnapshotReader:
+    def __init__(self, data):
+        """
+        Reads the values written by `encode_snapshot` in order.
+
+        Args:
+            data (bytes): Decompressed snapshot body
+        """
+        self.data = data
+        self.position = 0
+
+    def read_count(self):
+        """
+        Returns:
+            int
+        """
+        count, = SNAPSHOT_COUNT.unpack_from(self.data, self.position)
+        self.position += SNAPSHOT_COUNT.size
+        return count
+
+    def read_array(self, typecode, count):
+        """
+        Args:
+            typecode (str): Of `array.array`
+            count (int)
+
+        Returns:
+            array.array
+        """
+        values = array(typecode)
+        end = self.position + values.itemsize * count
+        values.frombytes(self.data[self.position:end])
+        if sys.byteorder == "big":
+            values.byteswap()
+        self.position = end
+        return values
+
+    def read_strings(self, count):
+        """
+        Args:
+            count (int)
+
+        Returns:
+            list of str: May contain None
+        """
+        lengths = self.read_array("i", count)
+        size = self.read_count()
+        text = self.data[self.position:self.position + size].decode("utf-8", "surrogatepass")
+        self.position += size
+        strings = []
+        start = 0
+        for length in lengths:
+            if length == -1:
+                strings.append(None)
+            else:
+                strings.append(text[start:start + length])
+                start += length
+        return strings
+
+
+class BotStore:
+    def __init__(self, path, journal_path, compact_size):
+        """
+        SQLite database holding the admin, channels, users and saved messages.
+
+        Changes are appended to a journal that a background thread writes and
+        fsyncs in batches, the database is a snapshot that the journal is
+        folded into once it grows past `compact_size`. Opening the store
+        replays whatever journal a previous run left over the snapshot.
+
+        Args:
+            path (str)
+            journal_path (str)
+            compact_size (int): Bytes
+        """
+        self.path = path
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(STORE_SCHEMA)
+            self.add_missing_columns()
+        self.journal_path = journal_path
+        self.compact_size = compact_size
+        # Guards pending, seq and flushed_seq
+        self.journal_condition = Condition()
+        self.pending = []
+        # Entries kept for the next delta backup, None until backups ask for them
+        self.backlog = None
+        self.seq = self.recover()
+        self.flushed_seq = self.seq
+        # Held while writing to or rotating the journal file
+        self.file_lock = Lock()
+        self.compact_lock = Lock()
+        self.compacting = False
+        self.closed = False
+        self.journal = open(journal_path, "a", encoding="utf-8")
+        self.flusher = Thread(target=self.flush_journal, name="journal-flusher", daemon=True)
+        self.flusher.start()
+
+    def add_missing_columns(self):
+        """
+        Adds the columns of STORE_TABLES that didn't exist yet when the
+        database was created.
+        """
+        for table, columns in STORE_TABLES.items():
+            existing = [row[1] for row in self.connection.execute("PRAGMA table_info({})".format(table))]
+            for column in columns:
+                if column not in existing:
+                    self.connection.execute("ALTER TABLE {} ADD COLUMN {}".format(table, column))
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the statements of the `with` block atomically, one block at a time.
+        """
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def is_empty(self):
+        """
+        Returns:
+            bool: Whether nothing was ever saved
+        """
+        self.compact()
+        with self.lock:
+            return self.connection.execute(
+                "SELECT NOT EXISTS (SELECT 1 FROM settings WHERE key = 'admin_id' "
+                "UNION ALL SELECT 1 FROM channels UNION ALL SELECT 1 FROM users)").fetchone()[0] == 1
+
+    def append(self, op, *args):
+        """
+        Adds a change to the journal, it is durable once the flusher fsyncs it.
+
+        Args:
+            op (str): One of the operations handled by `apply`
+            args: JSON serializable arguments of the operation
+        """
+        with self.journal_condition:
+            self.seq += 1
+            line = json.dumps([self.seq, op, args], ensure_ascii=False)
+            self.pending.append(line)
+            if self.backlog is not None:
+                self.backlog.append((self.seq, line))
+            self.journal_condition.notify_all()
+
+    def track_backlog(self):
+        """
+        Starts keeping the entries appended from now on until they are
+        dropped, for delta backups.
+        """
+        with self.journal_condition:
+            if self.backlog is None:
+                self.backlog = []
+
+    def get_backlog(self):
+        """
+        Returns:
+            list of tuple[int, str]: Sequence number and journal entry of
+                every change kept since the backlog was last dropped
+        """
+        with self.journal_condition:
+            return list(self.backlog or [])
+
+    def drop_backlog(self, seq):
+        """
+        Args:
+            seq (int): Sequence number up to which entries are discarded
+        """
+        with self.journal_condition:
+            if self.backlog is not None:
+                self.backlog = [entry for entry in self.backlog if entry[0] > seq]
+
+    def flush_journal(self):
+        while True:
+            with self.journal_condition:
+                while len(self.pending) == 0 and not self.closed:
+                    self.journal_condition.wait()
+                if len(self.pending) == 0:
+                    return
+                batch = self.pending
+                self.pending = []
+                seq = self.seq
+            # Changes appended while this batch is fsynced go in the next one
+            start = monotonic()
+            with self.file_lock:
+                self.journal.write("\n".join(batch) + "\n")
+                self.journal.flush()
+                os.fsync(self.journal.fileno())
+                size = self.journal.tell()
+            metrics.observe("journal_fsync", monotonic() - start)
+            metrics.increment("journal_entries", len(batch))
+            metrics.increment("journal_fsyncs")
+            with self.journal_condition:
+                self.flushed_seq = seq
+                self.journal_condition.notify_all()
+                if size >= self.compact_size and not self.compacting:
+                    self.compacting = True
+                    Thread(target=self.compact, name="journal-compactor", daemon=True).start()
+
+    def sync(self):
+        """
+        Waits until every change appended so far is fsynced.
+        """
+        with self.journal_condition:
+            target = self.seq
+            while self.flushed_seq < target:
+                self.journal_condition.wait()
+
+    def compact(self):
+        """
+        Folds the journal into the database and starts a new one.
+        """
+        with self.compact_lock:
+            try:
+                self.sync()
+                start = monotonic()
+                old_path = self.journal_path + ".old"
+                if os.path.exists(old_path):
+                    # Left by a compaction that failed, folded before it is replaced
+                    self.replay(old_path)
+                    os.remove(old_path)
+                with self.file_lock:
+                    if self.journal.tell() > 0:
+                        self.journal.close()
+                        os.replace(self.journal_path, old_path)
+                        self.journal = open(self.journal_path, "a", encoding="utf-8")
+                if os.path.exists(old_path):
+                    self.replay(old_path)
+                    os.remove(old_path)
+                    metrics.observe("journal_compaction", monotonic() - start)
+            finally:
+                with self.journal_condition:
+                    self.compacting = False
+
+    def recover(self):
+        """
+        Replays the journals left by a previous run over the database.
+
+        Returns:
+            int: Sequence number of the last change in the database
+        """
+        start = monotonic()
+        entries = 0
+        # A crash during compaction leaves the journal being folded as .old
+        for path in (self.journal_path + ".old", self.journal_path):
+            if os.path.exists(path):
+                entries += self.replay(path)
+                os.remove(path)
+        if entries > 0:
+            duration = monotonic() - start
+            metrics.observe("journal_recovery", duration)
+            logger.info("Replayed %d journal entries in %.3fs", entries, duration)
+        with self.lock:
+            return self.get_applied_seq(self.connection)
+
+    def replay(self, path):
+        """
+        Applies the entries of a journal file that aren't in the database yet.
+
+        Args:
+            path (str)
+
+        Returns:
+            int: Number of entries applied
+        """
+        with open(path, "r", encoding="utf-8") as file, self.transaction() as db:
+            applied, last_seq = self.apply_entries(db, file, self.get_applied_seq(db), allow_truncated=True)
+            db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('journal_seq', ?)",
+                       (json.dumps(last_seq),))
+        return applied
+
+    def apply_entries(self, db, lines, last_seq, allow_truncated=False):
+        """
+        Args:
+            db (sqlite3.Connection): Inside a transaction
+            lines (iterable of str): Journal entries
+            last_seq (int): Entries up to this sequence number are skipped
+            allow_truncated (bool): Whether a malformed last entry is
+                discarded instead of failing, a crash while writing the
+                journal cuts its last line short
+
+        Returns:
+            tuple[int, int]: Number of entries applied and sequence number
+                of the last one
+
+        Raises:
+            ValueError: If an entry is malformed
+        """
+        applied = 0
+        # Runs of added messages, the bulk of the journal, are inserted together
+        messages = []
+        truncated = None
+        for line in lines:
+            if line.strip() == "":
+                continue
+            if truncated is not None:
+                raise ValueError("Malformed journal entry: " + truncated[:100])
+            try:
+                seq, op, args = json.loads(line)
+            except ValueError:
+                if not allow_truncated:
+                    raise ValueError("Malformed journal entry: " + line[:100])
+                truncated = line
+                continue
+            if seq > last_seq:
+                if op == "message":
+                    messages.append(args)
+                else:
+                    db.executemany(STORE_MESSAGE_INSERT, messages)
+                    messages = []
+                    self.apply(db, op, args)
+                last_seq = seq
+                applied += 1
+        db.executemany(STORE_MESSAGE_INSERT, messages)
+        if truncated is not None:
+            logger.warning("Discarding truncated journal entry")
+        return applied, last_seq
+
+    @staticmethod
+    def get_applied_seq(db):
+        row = db.execute("SELECT value FROM settings WHERE key = 'journal_seq'").fetchone()
+        return json.loads(row[0]) if row is not None else 0
+
+    @staticmethod
+    def apply(db, op, args):
+        """
+        Args:
+            db (sqlite3.Connection): Inside a transaction
+            op (str)
+            args (list)
+        """
+        if op == "admin":
+            db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('admin_id', ?)",
+                       (json.dumps(args[0]),))
+        elif op == "channel":
+            db.execute(STORE_CHANNEL_UPSERT, args)
+        elif op == "delete_channel":
+            db.execute("DELETE FROM messages WHERE channel = ?", args)
+            db.execute("DELETE FROM channels WHERE username = ?", args)
+        elif op == "rename_channel":
+            old, new = args
+            db.execute("DELETE FROM messages WHERE channel = ?", (new,))
+            db.execute("DELETE FROM channels WHERE username = ?", (new,))
+            db.execute("UPDATE messages SET channel = ? WHERE channel = ?", (new, old))
+            db.execute("UPDATE channels SET username = ? WHERE username = ?", (new, old))
+        elif op == "message":
+            db.execute(STORE_MESSAGE_INSERT, args)
+        elif op == "posted_summary":
+            db.execute("DELETE FROM messages WHERE channel = ? AND last", (args[0],))
+            db.execute("UPDATE messages SET last = 1 WHERE channel = ?", (args[0],))
+            db.execute(STORE_CHANNEL_UPSERT, args)
+        elif op == "user":
+            # Entries journaled before a column was added lack its value
+            db.execute(STORE_USER_UPSERT, args + [None] * (len(STORE_USER_COLUMNS) - len(args)))
+        elif op == "delete_user":
+            db.execute("DELETE FROM users WHERE key = ?", args)
+        elif op == "delete_users":
+            db.executemany("DELETE FROM users WHERE key = ?", [(key,) for key in args])
+        elif op == "trim_messages":
+            atusername, last, count = args
+            db.execute("DELETE FROM messages WHERE channel = ? AND last = ? AND id NOT IN "
+                       "(SELECT id FROM messages WHERE channel = ? AND last = ? ORDER BY id DESC LIMIT ?)",
+                       (atusername, last, atusername, last, count))
+        else:
+            logger.error("Unknown journal operation %s", op)
+
+    def set_admin(self, admin_id):
+        """
+        Args:
+            admin_id (int)
+        """
+        self.append("admin", admin_id)
+
+    def save_channel(self, atusername, reg_channel):
+        """
+        Saves every field of the channel except its saved messages.
+
+        Args:
+            atusername (str)
+            reg_channel (RegisteredChannel)
+        """
+        self.append("channel", *get_channel_row(atusername, reg_channel))
+
+    def delete_channel(self, atusername):
+        """
+        Args:
+            atusername (str)
+        """
+        self.append("delete_channel", atusername)
+
+    def rename_channel(self, old, new):
+        """
+        Args:
+            old (str)
+            new (str): Replaces any channel already saved with this username
+        """
+        self.append("rename_channel", old, new)
+
+    def add_message(self, atusername, message, last):
+        """
+        Args:
+            atusername (str)
+            message (SavedMessage)
+            last (bool): Whether `message` belongs to the last summary instead
+                of the next one
+        """
+        self.append("message", *get_message_row(atusername, message, last))
+
+    def save_posted_summary(self, atusername, reg_channel):
+        """
+        Saves a channel right after posting its summary, when the saved
+        messages became the last summary's messages.
+
+        Args:
+            atusername (str)
+            reg_channel (RegisteredChannel)
+        """
+        self.append("posted_summary", *get_channel_row(atusername, reg_channel))
+
+    def save_user(self, key, reg_user):
+        """
+        Args:
+            key (str)
+            reg_user (RegisteredUser)
+        """
+        self.append("user", *get_user_row(key, reg_user))
+
+    def delete_user(self, key):
+        """
+        Args:
+            key (str)
+        """
+        self.append("delete_user", key)
+
+    def delete_users(self, keys):
+        """
+        Args:
+            keys (list of str)
+        """
+        if len(keys) > 0:
+            self.append("delete_users", *keys)
+
+    def get_local_setting(self, key):
+        """
+        Args:
+            key (str): One of LOCAL_SETTINGS
+
+        Returns:
+            The value of the setting, None if it isn't set
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set_local_setting(self, key, value):
+        """
+        Saves a setting right away in the database, instead of through the
+        journal, so that neither backups nor restores carry it.
+
+        Args:
+            key (str): One of LOCAL_SETTINGS
+            value: JSON serializable, None to remove the setting
+        """
+        with self.transaction() as db:
+            if value is None:
+                db.execute("DELETE FROM settings WHERE key = ?", (key,))
+            else:
+                db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                           (key, json.dumps(value, ensure_ascii=False)))
+
+    def trim_messages(self, atusername, last, count):
+        """
+        Args:
+            atusername (str)
+            last (bool): Whether to trim the last summary's messages instead
+                of the next one's
+            count (int): Number of most recent messages kept
+        """
+        self.append("trim_messages", atusername, last, count)
+
+    def import_tables(self, tables, entries=(), base_seq=0):
+        """
+        Replaces everything saved with `tables`.
+
+        Args:
+            tables (dict[str, list]): Rows of each table in STORE_TABLES
+            entries (iterable of str): Journal entries of delta backups to
+                apply over `tables`
+            base_seq (int): Sequence number `tables` were taken at
+        """
+        self.compact()
+        with self.transaction() as db:
+            db.execute("DELETE FROM settings WHERE key NOT IN ({})".format(
+                ", ".join("?" * len(LOCAL_SETTINGS))), LOCAL_SETTINGS)
+            for table in ("channels", "users", "messages"):
+                db.execute("DELETE FROM " + table)
+            # The sequence numbers of the backup belong to the run that made it
+            db.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                           [row for row in tables["settings"] if row[0] not in LOCAL_SETTINGS])
+            db.executemany(STORE_CHANNEL_UPSERT, tables["channels"])
+            db.executemany(STORE_MESSAGE_INSERT, tables["messages"])
+            db.executemany(STORE_USER_UPSERT, tables["users"])
+            self.apply_entries(db, entries, base_seq)
+
+    def load(self, lazy=False):
+        """
+        Args:
+            lazy (bool): Whether to leave the messages of each channel in the
+                database until the channel uses them
+
+        Returns:
+            dict: Everything saved, in the same shape as a bot_data.json backup
+        """
+        return build_bot_data(self.read_tables(with_messages=not lazy), self.load_messages)
+
+    def read_tables(self, with_messages=True):
+        """
+        Args:
+            with_messages (bool)
+
+        Returns:
+            dict[str, list]: Rows of each table in STORE_TABLES, settings
+                include the sequence number of the last change they contain
+        """
+        self.compact()
+        # A read transaction on a connection of its own sees a consistent
+        # snapshot of the database without holding the store's lock, so the
+        # compactor can fold new changes while it is read
+        db = sqlite3.connect(self.path, isolation_level=None)
+        try:
+            db.execute("BEGIN")
+            return {table: db.execute("SELECT {} FROM {} ORDER BY rowid".format(
+                ", ".join(columns), table)).fetchall()
+                for table, columns in STORE_TABLES.items() if with_messages or table != "messages"}
+        finally:
+            db.close()
+
+    def load_messages(self, atusername):
+        """
+        Args:
+            atusername (str)
+
+        Returns:
+            tuple[list of SavedMessage, list of SavedMessage]: The saved
+                messages and the last saved messages of the channel
+        """
+        start = monotonic()
+        db = sqlite3.connect(self.path, isolation_level=None)
+        try:
+            rows = db.execute("SELECT last, message_id, text, category, parts FROM messages "
+                              "WHERE channel = ? ORDER BY id", (atusername,)).fetchall()
+        finally:
+            db.close()
+        messages = ([], [])
+        for last, message_id, text, category, parts in rows:
+            messages[last].append(SavedMessage(message_id, text, category, parts))
+        metrics.increment("channels_materialized")
+        metrics.observe("channel_materialize", monotonic() - start)
+        return messages
+
+    def close(self):
+        """
+        Fsyncs the changes still pending and stops the flusher.
+        """
+        with self.journal_condition:
+            self.closed = True
+            self.journal_condition.notify_all()
+        self.flusher.join()
+        # Waits for a compaction the flusher may have started
+        with self.compact_lock:
+            self.journal.close()
+
+
+def get_channel_row(atusername, reg_channel):
+    """
+    Args:
+        atusername (str)
+        reg_channel (RegisteredChannel)
+
+    Returns:
+        list: Values of STORE_CHANNEL_COLUMNS
+    """
+    return [atusername, reg_channel.chat_id, reg_channel.template,
+            reg_channel.template_picture, reg_channel.template_time_dif,
+            reg_channel.last_summary_message_id, reg_channel.last_summary_message_text,
+            json.dumps(reg_channel.categories),
+            reg_channel.last_summary_time.isoformat(), reg_channel.template_format,
+            reg_channel.parts_identifier, reg_channel.summary_edit_window]
+
+
+def get_message_row(atusername, message, last):
+    """
+    Args:
+        atusername (str)
+        message (SavedMessage)
+        last (bool)
+
+    Returns:
+        list: Values of a row of the messages table
+    """
+    return [atusername, last, message.message_id, message.text, message.category, message.parts]
+
+
+def get_user_row(key, reg_user):
+    """
+    Args:
+        key (str)
+        reg_user (RegisteredUser)
+
+    Returns:
+        list: Values of STORE_USER_COLUMNS
+    """
+    return [key, reg_user.chat_id, reg_user.status,
+            json.dumps(reg_user.context_data), json.dumps(reg_user.known_channels),
+            reg_user.last_seen.isoformat() if reg_user.last_seen is not None else None]
 
 
-class RegisteredUser:
-    def __init__(self, chat_id=0, status="", context_data=None, known_channels=None):
-        """
-        Args:
-            chat_id (int)
-            status (str)
-            context_data (dict[str, str])
-            known_channels (list of str)
-        """
-        self.chat_id = chat_id
-        self.status = status
-        if context_data is not None:
-            self.context_data = context_data
-        else:
-            self.context_data = {}
-        if known_channels is not None:
-            self.known_channels = known_channels
-        else:
-            self.known_channels = []
+def build_bot_data(tables, load_messages=None):
+    """
+    Args:
+        tables (dict[str, list]): Rows of each table in STORE_TABLES, without
+            "messages" to load the messages of each channel when it uses them
+        load_messages (callable): Takes a channel username and returns its
+            saved messages and last saved messages, required without "messages"
+
+    Returns:
+        dict: The rows as a bot_data.json backup is decoded
+    """
+    settings = dict(tables["settings"])
+    channel_messages = {}
+    for channel, last, message_id, text, category, parts in tables.get("messages", []):
+        channel_messages.setdefault((channel, last), []).append(
+            SavedMessage(message_id, text, category, parts))
+    registered = {}
+    for (atusername, chat_id, template, template_picture, template_time_dif,
+         last_summary_message_id, last_summary_message_text, categories, last_summary_time,
+         template_format, parts_identifier, summary_edit_window) in tables["channels"]:
+        registered[atusername] = RegisteredChannel(
+            chat_id=chat_id,
+            template=template,
+            template_picture=template_picture,
+            template_time_dif=template_time_dif,
+            saved_messages=channel_messages.get((atusername, 0), []),
+            last_saved_messages=channel_messages.get((atusername, 1), []),
+            last_summary_message_id=last_summary_message_id,
+            categories=json.loads(categories),
+            last_summary_time=datetime.fromisoformat(last_summary_time),
+            last_summary_message_text=last_summary_message_text,
+            template_format=template_format,
+            parts_identifier=parts_identifier,
+            summary_edit_window=summary_edit_window,
+            message_loader=partial(load_messages, atusername) if "messages" not in tables else None)
+    users = tables["users"]
+    contexts = decode_json_column([user[3] for user in users])
+    known_channels = decode_json_column([user[4] for user in users])
+    return {
+        'admin_id': json.loads(settings['admin_id']) if 'admin_id' in settings else -1,
+        'registered_channels': registered,
+        'registered_users': {user[0]: RegisteredUser(chat_id=user[1],
+                                                     status=user[2],
+                                                     context_data=contexts[i],
+                                                     known_channels=known_channels[i],
+                                                     last_seen=datetime.fromisoformat(user[5])
+                                                     if user[5] is not None else None)
+                             for i, user in enumerate(users)}
+    }
+
+
+def decode_json_column(values):
+    """
+    Args:
+        values (list of str): JSON documents
+
+    Returns:
+        list: The decoded documents, parsed at once since parsing many small
+            documents one by one is mostly call overhead
+    """
+    return json.loads("[{}]".format(",".join(values)))
+
+
+def get_backup_tables(dct):
+    """
+    Args:
+        dct (dict): A bot_data.json backup loaded without `decode_bot_data`
+
+    Returns:
+        dict[str, list]: Rows of each table in STORE_TABLES
+    """
+    channels = []
+    messages = []
+    for atusername, channel in dct['registered_channels'].items():
+        channels.append([atusername, channel['chat_id'], channel['template'], channel['template_picture'],
+                         channel['template_time_dif'], channel['last_summary_message_id'],
+                         channel['last_summary_message_text'], json.dumps(channel['categories']),
+                         channel['last_summary_time'], channel['template_format'],
+                         channel['parts_identifier'], channel.get('summary_edit_window')])
+        for last, key in ((1, 'last_saved_messages'), (0, 'saved_messages')):
+            messages.extend([atusername, last, message['id'], message['text'], message['cat'], message['parts']]
+                            for message in channel[key])
+    return {
+        "settings": [["admin_id", json.dumps(dct['admin_id'])]],
+        "channels": channels,
+        "messages": messages,
+        "users": [[key, user['chat_id'], user['status'],
+                   json.dumps(user['context_data']), json.dumps(user['known_channels']),
+                   user.get('last_seen')]
+                  for key, user in dct['registered_users'].items()]
+    }
+
+
+def upsert_statement(table, columns):
+    """
+    Args:
+        table (str)
+        columns (list of str): The first one is the primary key
+
+    Returns:
+        str: Statement that inserts a row or updates it in place, keeping its
+            rowid so that rows are loaded in the order they were first saved
+    """
+    return "INSERT INTO {0} ({1}) VALUES ({2}) ON CONFLICT ({3}) DO UPDATE SET {4}".format(
+        table, ", ".join(columns), ", ".join("?" * len(columns)), columns[0],
+        ", ".join("{0} = excluded.{0}".format(column) for column in columns[1:]))
 
 
 PORT = int(os.environ.get('PORT', 8443))
 BOT_CLOUD = os.environ.get('BOT_CLOUD')
+SUMMARY_EDIT_WINDOW = float(os.environ.get('SUMMARY_EDIT_WINDOW', 3))  # seconds
+GLOBAL_RATE_LIMIT = float(os.environ.get('GLOBAL_RATE_LIMIT', 30))  # calls per second
+CHAT_RATE_LIMIT = float(os.environ.get('CHAT_RATE_LIMIT', 20))  # calls per minute to a group or channel
+PRIVATE_RATE_LIMIT = float(os.environ.get('PRIVATE_RATE_LIMIT', 1))  # calls per second to a private chat
+PRIVATE_BURST = float(os.environ.get('PRIVATE_BURST', 3))  # calls
+DISPATCHER_WORKERS = int(os.environ.get('DISPATCHER_WORKERS', 4))
+# Dispatcher, workers, webhook and the timer threads all share the bot's connections
+CON_POOL_SIZE = int(os.environ.get('CON_POOL_SIZE', DISPATCHER_WORKERS + 8))
+CONNECT_TIMEOUT = float(os.environ.get('CONNECT_TIMEOUT', 5))  # seconds
+READ_TIMEOUT = float(os.environ.get('READ_TIMEOUT', 10))  # seconds
+BOT_MEMBER_TTL = float(os.environ.get('BOT_MEMBER_TTL', 300))  # seconds
+ADMIN_CACHE_TTL = float(os.environ.get('ADMIN_CACHE_TTL', 60))  # seconds
+DATABASE_PATH = os.environ.get('DATABASE_PATH', 'bot_data.db')
+JOURNAL_PATH = os.environ.get('JOURNAL_PATH', 'bot_data.journal')
+JOURNAL_COMPACT_SIZE = int(os.environ.get('JOURNAL_COMPACT_SIZE', 4 * 1024 * 1024))  # bytes
+BACKUP_FORMAT = os.environ.get('BACKUP_FORMAT', 'json')  # json or snapshot
+# 36 deltas of BACKUP_TIME_DIF minutes are 12 hours
+BACKUP_DELTAS_PER_BASE = int(os.environ.get('BACKUP_DELTAS_PER_BASE', 36))
+SNAPSHOT_COMPRESSION = os.environ.get('SNAPSHOT_COMPRESSION', 'zlib')  # zlib or lzma
+CLEANUP_TIME_DIF = float(os.environ.get('CLEANUP_TIME_DIF', 6 * 60))  # minutes
+# Users without registered channels are forgotten after this long without updates
+USER_IDLE_TTL = float(os.environ.get('USER_IDLE_TTL', 30))  # days
+# Channels the bot isn't a member of are unregistered after this long without a summary
+REMOVED_CHANNEL_TTL = float(os.environ.get('REMOVED_CHANNEL_TTL', 7))  # days
+# A summary this long is past Telegram's message length limit anyway
+MAX_LAST_SAVED_MESSAGES = int(os.environ.get('MAX_LAST_SAVED_MESSAGES', 100))
+SCHEDULER_WORKERS = int(os.environ.get('SCHEDULER_WORKERS', 4))
+# Channel updates of a channel always go to the same shard, in order
+CHANNEL_SHARDS = int(os.environ.get('CHANNEL_SHARDS', DISPATCHER_WORKERS))
+# Runs of periodic jobs are moved randomly by up to this fraction of their interval
+SCHEDULER_JITTER = float(os.environ.get('SCHEDULER_JITTER', 0.1))
+JOB_TIMEOUT = float(os.environ.get('JOB_TIMEOUT', 15 * 60))  # seconds
+SHUTDOWN_BACKUP_WAIT = float(os.environ.get('SHUTDOWN_BACKUP_WAIT', 10))  # seconds
+# Threads sending a broadcast, the outbound limiter paces them anyway
+BROADCAST_WORKERS = int(os.environ.get('BROADCAST_WORKERS', 4))
+# Users sent to between saves of a broadcast's progress
+BROADCAST_CHECKPOINT_SIZE = int(os.environ.get('BROADCAST_CHECKPOINT_SIZE', 100))
+# Locks the registered channels and users are spread over
+REGISTRY_STRIPES = int(os.environ.get('REGISTRY_STRIPES', 256))
 
 # Enable logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -162,8 +2179,103 @@ logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s
 
 logger = logging.getLogger(__name__)
 
+PRIORITY_INTERACTIVE = 0
+PRIORITY_SUMMARY = 1
+PRIORITY_BULK = 2
+
+CHAT_LIMITED_ENDPOINTS = {'sendMessage', 'sendPhoto', 'sendDocument',
+                          'editMessageText', 'pinChatMessage'}
+RETRY_AFTER_ATTEMPTS = 3
+MAX_CHAT_BUCKETS = 10000
+
+STORE_CHANNEL_COLUMNS = ["username", "chat_id", "template", "template_picture", "template_time_dif",
+                         "last_summary_message_id", "last_summary_message_text", "categories",
+                         "last_summary_time", "template_format", "parts_identifier",
+                         "summary_edit_window"]
+STORE_USER_COLUMNS = ["key", "chat_id", "status", "context_data", "known_channels", "last_seen"]
+STORE_MESSAGE_COLUMNS = ["channel", "last", "message_id", "text", "category", "parts"]
+STORE_TABLES = {
+    "settings": ["key", "value"],
+    "channels": STORE_CHANNEL_COLUMNS,
+    "messages": STORE_MESSAGE_COLUMNS,
+    "users": STORE_USER_COLUMNS
+}
+# Settings that belong to this run's database, backups neither carry nor replace them
+LOCAL_SETTINGS = ("journal_seq", "broadcast", "broadcast_progress")
+STORE_CHANNEL_UPSERT = upsert_statement("channels", STORE_CHANNEL_COLUMNS)
+STORE_USER_UPSERT = upsert_statement("users", STORE_USER_COLUMNS)
+STORE_MESSAGE_INSERT = "INSERT INTO messages (channel, last, message_id, text, category, parts) " \
+                       "VALUES (?, ?, ?, ?, ?, ?)"
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS channels (
+    username TEXT PRIMARY KEY,
+    chat_id INTEGER,
+    template TEXT,
+    template_picture TEXT,
+    template_time_dif INTEGER,
+    last_summary_message_id INTEGER,
+    last_summary_message_text TEXT,
+    categories TEXT,
+    last_summary_time TEXT,
+    template_format TEXT,
+    parts_identifier TEXT,
+    summary_edit_window REAL
+);
+CREATE TABLE IF NOT EXISTS users (
+    key TEXT PRIMARY KEY,
+    chat_id INTEGER,
+    status TEXT,
+    context_data TEXT,
+    known_channels TEXT,
+    last_seen TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    channel TEXT NOT NULL,
+    last INTEGER NOT NULL,
+    message_id INTEGER,
+    text TEXT,
+    category TEXT,
+    parts TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_by_channel ON messages (channel, last);
+"""
+
+metrics = Metrics()
+outbound_limiter = OutboundLimiter(GLOBAL_RATE_LIMIT, CHAT_RATE_LIMIT / 60, CHAT_RATE_LIMIT,
+                                   PRIVATE_RATE_LIMIT, PRIVATE_BURST)
+outbound_context = local()
+
+
+@contextmanager
+def outbound_priority(priority):
+    """
+    Sets the priority of the Bot API calls made by this thread inside the block.
+
+    Args:
+        priority (int)
+    """
+    previous = get_outbound_priority()
+    outbound_context.priority = priority
+    try:
+        yield
+    finally:
+        outbound_context.priority = previous
+
+
+def get_outbound_priority():
+    """
+    Returns:
+        int: Priority of the Bot API calls made by this thread
+    """
+    return getattr(outbound_context, 'priority', PRIORITY_INTERACTIVE)
+
+
 TOKEN = os.environ.get('TOKEN', '')
-bot = Bot(token=TOKEN)
+bot = RateLimitedBot(token=TOKEN, request=PooledRequest(con_pool_size=CON_POOL_SIZE,
+                                                         connect_timeout=CONNECT_TIMEOUT,
+                                                         read_timeout=READ_TIMEOUT))
 
 
 CANCEL_MARKUP = "🔙 Atrás 🔙"
@@ -297,22 +2409,93 @@ REORDER_CATEGORIES_HELP = """
 ↕ Reordenar Categorías:
  Este botón te permitirá seleccionar una categoría y moverla en la lista."""
 
+ESCAPE_CACHE_SIZE = 256
+
+SUMMARY_SIGNATURE = "\n🤖📝 [\\[Bot de Resúmenes\\]](t.me/ForceGamesHelperBot) 📝🤖"
+
 MAX_KNOWN_CHANNELS = 5
 MAX_CHARACTERS_IN_TITLE = 64
 
 BACKUP_TIME_DIF = 20  # minutes
+CACHE_PURGE_TIME_DIF = 10  # minutes
+SUMMARY_RETRY_TIME_DIF = 60  # minutes
+# Below this many categories testing every line for each one is faster than
+# PatternMatcher's str.find over the whole message per category
+PATTERN_MATCHER_MIN_CATEGORIES = 16
+# Channels listed in /stats by how long their last summary took to be pinned
+SLOWEST_SUMMARIES_SHOWN = 5
+BACKUP_FILENAME = "bot_data.json.gz"
+BACKUP_COMPRESSION_LEVEL = 6
+GZIP_MAGIC = b"\x1f\x8b"
+SNAPSHOT_FILENAME = "bot_data.snapshot"
+DELTA_FILENAME = "bot_data.delta"
+MANIFEST_FILENAME = "bot_data.manifest"
+BACKUP_MANIFEST_VERSION = 1
+MANIFEST_MAGIC = b'{"manifest"'
+SNAPSHOT_MAGIC = b"FGHS"
+SNAPSHOT_VERSION = 2
+# Magic, schema version and compression
+SNAPSHOT_HEADER = Struct("<4sHB")
+SNAPSHOT_COUNT = Struct("<I")
+SNAPSHOT_COMPRESSIONS = {"zlib": 1, "lzma": 2}
+SNAPSHOT_CODECS = {
+    1: (lambda data: zlib.compress(data, 9), zlib.decompress),
+    2: (lzma.compress, lzma.decompress)
+}
+# Kind of each column of STORE_TABLES in every schema version, "intern"
+# columns hold strings that repeat a lot, like categories or statuses
+SNAPSHOT_COLUMNS = {
+    1: {
+        "settings": ["intern", "str"],
+        "channels": ["intern", "int", "str", "str", "int", "int", "str", "str", "str", "str", "str", "float"],
+        "messages": ["intern", "int", "int", "str", "intern", "str"],
+        "users": ["str", "int", "intern", "intern", "intern"]
+    },
+    2: {
+        "settings": ["intern", "str"],
+        "channels": ["intern", "int", "str", "str", "int", "int", "str", "str", "str", "str", "str", "float"],
+        "messages": ["intern", "int", "int", "str", "intern", "str"],
+        "users": ["str", "int", "intern", "intern", "intern", "str"]
+    }
+}
+# Functions that take the tables of a snapshot of a schema version and
+# return them as they are in the next one
+SNAPSHOT_MIGRATIONS = {
+    # Version 2 added the users' last_seen
+    1: lambda tables: dict(tables, users=[row + (None,) for row in tables["users"]])
+}
 
 admin_chat_id = -1
 
-registered_channels: dict[str, RegisteredChannel] = {}
-registered_users: dict[str, RegisteredUser] = {}
+# Never rebound, restoring data replaces their entries
+registered_channels = Registry(REGISTRY_STRIPES)
+registered_users = Registry(REGISTRY_STRIPES)
 
 if BOT_CLOUD is not None and BOT_CLOUD != "":
     bot_cloud = bot.get_chat(BOT_CLOUD)
 else:
     bot_cloud = None
 
-update_checker: list[datetime] = []
+# Last time the data was loaded or restored, None if there was nothing to load
+last_restore_time: Optional[datetime] = None
+# Set once startup loaded the data, updates wait for it in `wait_until_ready`
+bot_ready = Event()
+# Set once startup loaded the data or failed to
+startup_finished = Event()
+
+scheduler = JobScheduler(SCHEDULER_WORKERS)
+channel_queues = ChannelQueues(CHANNEL_SHARDS)
+summary_editor = SummaryEditCoalescer()
+bot_member_cache = TTLCache("bot_member_cache", BOT_MEMBER_TTL)
+admin_cache = TTLCache("admin_cache", ADMIN_CACHE_TTL)
+chat_cache = TTLCache("chat_cache", ADMIN_CACHE_TTL)
+store = BotStore(DATABASE_PATH, JOURNAL_PATH, JOURNAL_COMPACT_SIZE)
+# Held while a backup is being uploaded
+backup_lock = Lock()
+# Base and deltas of the pinned backup, None until this run uploads a base
+backup_manifest = None
+# Broadcast being sent, None if there is none
+current_broadcast: Optional[Broadcast] = None
 
 
 def start(update, context):
@@ -330,6 +2513,7 @@ def start(update, context):
         else:
             update.message.reply_text("Ahora eres mi onii-chan! :3")
             admin_chat_id = user.id
+            store.set_admin(admin_chat_id)
 
     go_to_base(update, context)
 
@@ -341,16 +2525,261 @@ def broadcast(update, context):
         context (telegram.ext.CallbackContext)
     """
     if update.effective_user.id == admin_chat_id:
-        for user in registered_users.values():
-            try:
-                bot.send_message(
-                    user.chat_id, update.message.text.replace("/broadcast", ""))
-            except TelegramError:
-                registered_users.pop(str(user.chat_id))
+        text = update.message.text.replace("/broadcast", "")
+        if text.strip() == "":
+            update.message.reply_text("Usage: /broadcast text")
+            return
+        if current_broadcast is not None:
+            update.message.reply_text("A broadcast is already running.\n" + current_broadcast.get_text())
+            return
+        keys = registered_users.keys()
+        start_broadcast(Broadcast(text, keys, datetime.now()))
+        update.message.reply_text("Broadcasting to {} users.".format(len(keys)))
+
+
+def start_broadcast(outgoing):
+    """
+    Saves the broadcast and sends it in the background.
+
+    Args:
+        outgoing (Broadcast)
+    """
+    global current_broadcast
+    current_broadcast = outgoing
+    store.set_local_setting("broadcast", {"text": outgoing.text, "keys": outgoing.keys,
+                                          "created": outgoing.created.isoformat()})
+    outgoing.save_progress()
+    scheduler.schedule("broadcast", 0, partial(run_broadcast, outgoing))
+
+
+def resume_broadcast():
+    """
+    Sends the rest of the broadcast a previous run was sending, if any.
+    """
+    saved = store.get_local_setting("broadcast")
+    if saved is None:
+        return
+    progress = store.get_local_setting("broadcast_progress") or {}
+    outgoing = Broadcast(saved["text"], saved["keys"], datetime.fromisoformat(saved["created"]), **progress)
+    logger.info("Resuming broadcast at %d/%d users", outgoing.position, len(outgoing.keys))
+    start_broadcast(outgoing)
+
+
+def run_broadcast(outgoing):
+    """
+    Sends the broadcast from BROADCAST_WORKERS threads, then forgets the
+    users whose chats are gone and reports to the admin.
+
+    Args:
+        outgoing (Broadcast)
+    """
+    global current_broadcast
+    try:
+        workers = [Thread(target=send_broadcast, args=(outgoing,), name="broadcast-worker", daemon=True)
+                   for _ in range(BROADCAST_WORKERS)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        outgoing.save_progress()
+
+        pruned = []
+        for key in outgoing.dead:
+            with registered_users.lock(key):
+                reg_user = registered_users.get(key)
+                # Users that talked to the bot since it started could have unblocked it
+                if reg_user is not None and (reg_user.last_seen is None or reg_user.last_seen < outgoing.created):
+                    registered_users.pop(key)
+                    pruned.append(key)
+        store.delete_users(pruned)
+        metrics.increment("broadcast_pruned", len(pruned))
+
+        store.set_local_setting("broadcast", None)
+        store.set_local_setting("broadcast_progress", None)
+    finally:
+        # A broadcast that failed is resumed by the next run
+        current_broadcast = None
+    elapsed = outgoing.get_elapsed()
+    text = "Broadcast finished in {:.0f}s: {} sent, {} failed, {} dead chats pruned, {:.1f} messages/s".format(
+        elapsed, outgoing.sent, outgoing.failed, len(pruned),
+        (outgoing.sent + outgoing.failed + len(outgoing.dead)) / max(elapsed, 1e-3))
+    logger.info(text)
+    if admin_chat_id != -1:
+        bot.send_message(admin_chat_id, text)
+
+
+def send_broadcast(outgoing):
+    """
+    Sends the broadcast to the users no other worker took yet.
+
+    Args:
+        outgoing (Broadcast)
+    """
+    with outbound_priority(PRIORITY_BULK):
+        while True:
+            index = outgoing.take()
+            if index is None:
+                return
+            reg_user = registered_users.get(outgoing.keys[index])
+            outcome = None
+            if reg_user is not None:
+                try:
+                    bot.send_message(reg_user.chat_id, outgoing.text)
+                    outcome = "sent"
+                except TelegramError as e:
+                    if is_dead_chat_error(e):
+                        outcome = "dead"
+                    else:
+                        logger.warning("Broadcast to %s failed: %s", outgoing.keys[index], e)
+                        outcome = "failed"
+                metrics.increment("broadcast_" + outcome)
+            if outgoing.finish(index, outcome):
+                outgoing.save_progress()
+
+
+def is_dead_chat_error(e):
+    """
+    Args:
+        e (TelegramError)
+
+    Returns:
+        bool: Whether `e` means the user blocked the bot or deleted the chat
+    """
+    return isinstance(e, Unauthorized) or (isinstance(e, BadRequest) and "chat not found" in e.message.lower())
+
+
+def cleanup():
+    """
+    Unregisters the channels the bot was removed from a while ago, forgets
+    idle users that have no registered channels and drops the oldest
+    messages of long last summaries.
+
+    Returns:
+        dict[str, int]: Number of channels, users and messages evicted, and
+            an estimate of the bytes of memory they held
+    """
+    start = monotonic()
+    now = datetime.now()
+    evicted = {"channels": 0, "users": 0, "messages": 0, "bytes": 0}
+
+    removed_before = now - timedelta(days=REMOVED_CHANNEL_TTL)
+    for atusername, reg_channel in registered_channels.items():
+        # A channel still posting its summaries still has the bot in it
+        if reg_channel.last_summary_time < removed_before and is_bot_removed(atusername):
+            with registered_channels.lock(atusername):
+                if registered_channels.get(atusername) is not reg_channel:
+                    continue
+                registered_channels.pop(atusername)
+                store.delete_channel(atusername)
+                scheduler.cancel("summary:" + atusername)
+            bot_member_cache.invalidate(atusername)
+            evicted["channels"] += 1
+            evicted["bytes"] += get_deep_size(reg_channel)
+            logger.info("Unregistered %s, the bot is no longer in it", atusername)
+        elif reg_channel._message_loader is None:
+            # Channels whose messages are still in the database hold no memory
+            with registered_channels.lock(atusername):
+                dropped = reg_channel.last_saved_messages.keep_last(MAX_LAST_SAVED_MESSAGES)
+                if len(dropped) > 0:
+                    store.trim_messages(atusername, True, MAX_LAST_SAVED_MESSAGES)
+            if len(dropped) > 0:
+                evicted["messages"] += len(dropped)
+                evicted["bytes"] += get_deep_size(dropped)
+
+    idle_before = now - timedelta(days=USER_IDLE_TTL)
+    for key, reg_user in registered_users.items():
+        with registered_users.lock(key):
+            if registered_users.get(key) is not reg_user:
+                continue
+            owned = [channel for channel in reg_user.known_channels if channel in registered_channels]
+            if reg_user.last_seen is None:
+                # Users saved before last_seen was recorded start counting now
+                reg_user.last_seen = now
+                store.save_user(key, reg_user)
+            elif len(owned) == 0 and reg_user.last_seen < idle_before:
+                registered_users.pop(key)
+                store.delete_user(key)
+                evicted["users"] += 1
+                evicted["bytes"] += get_deep_size(reg_user)
+            elif len(owned) < len(reg_user.known_channels):
+                reg_user.known_channels = owned
+                store.save_user(key, reg_user)
+
+    for name in ("channels", "users", "messages"):
+        metrics.increment("cleanup_{}_evicted".format(name), evicted[name])
+    metrics.increment("cleanup_bytes_reclaimed", evicted["bytes"])
+    metrics.observe("cleanup", monotonic() - start)
+    logger.info("Cleanup evicted %d channels, %d users and %d messages, about %d bytes",
+                evicted["channels"], evicted["users"], evicted["messages"], evicted["bytes"])
+    return evicted
+
+
+def auto_cleanup():
+    with outbound_priority(PRIORITY_BULK):
+        cleanup()
+
+
+def purge_caches():
+    for cache in (bot_member_cache, admin_cache, chat_cache):
+        cache.purge()
+
+
+def is_bot_removed(atusername):
+    """
+    Args:
+        atusername (str)
+
+    Returns:
+        bool: Whether the bot is certainly not a member of the channel, False
+            if it couldn't be checked
+    """
+    try:
+        bot_member = get_bot_chat_member(atusername)
+    except TelegramError as e:
+        return is_permission_error(e)
+    return bot_member.status in (ChatMember.LEFT, ChatMember.KICKED)
+
 
+def get_deep_size(obj):
+    """
+    Args:
+        obj: A model, or a container of models and plain values
 
-def cleanup():  # TODO
-    return
+    Returns:
+        int: Approximate bytes held by `obj` and everything it references,
+            objects referenced more than once are counted once
+    """
+    seen = set()
+    pending = [obj]
+    size = 0
+    while len(pending) > 0:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set)):
+            pending.extend(obj)
+        elif isinstance(obj, (SavedMessage, MessageStore, RegisteredChannel, RegisteredUser)):
+            pending.extend(getattr(obj, name) for name in type(obj).__slots__ if hasattr(obj, name))
+    return size
+
+
+def cleanup_command(update, context):
+    """
+    Args:
+        update (telegram.Update)
+        context (telegram.ext.CallbackContext)
+    """
+    if update.effective_user.id == admin_chat_id:
+        with outbound_priority(PRIORITY_BULK):
+            evicted = cleanup()
+        update.message.reply_text(
+            "Evicted {} channels, {} users and {} messages, about {:.1f} KB reclaimed.".format(
+                evicted["channels"], evicted["users"], evicted["messages"], evicted["bytes"] / 1024))
 
 
 def get_chat_id(update, context):
@@ -381,37 +2810,389 @@ def stats(update, context):
             "Last Update: {}".\
             format(len(registered_channels),
                    len(registered_users),
-                   (update_checker[0].isoformat(), "Never")[len(update_checker) == 0])
+                   last_restore_time.isoformat() if last_restore_time is not None else "Never")
+        scheduler_text = scheduler.get_text()
+        if scheduler_text != "":
+            text += "\n\n" + scheduler_text
+        outgoing = current_broadcast
+        if outgoing is not None:
+            text += "\n\n" + outgoing.get_text()
+        post_to_pin_text = get_post_to_pin_text()
+        if post_to_pin_text != "":
+            text += "\n\n" + post_to_pin_text
+        metrics_text = metrics.get_text()
+        if metrics_text != "":
+            text += "\n\n" + metrics_text
         update.message.reply_text(text)
 
 
+def get_post_to_pin_text():
+    """
+    Returns:
+        str: The channels whose last summary took the longest to be sent and
+            pinned, one per line
+    """
+    latencies = sorted(((reg_channel._post_to_pin, atusername)
+                        for atusername, reg_channel in registered_channels.items()
+                        if reg_channel._post_to_pin is not None), reverse=True)
+    return "\n".join("Post to pin {}: {:.3f}s".format(atusername, latency)
+                     for latency, atusername in latencies[:SLOWEST_SUMMARIES_SHOWN])
+
+
+def edit_window(update, context):
+    """
+    Args:
+        update (telegram.Update)
+        context (telegram.ext.CallbackContext)
+    """
+    if update.effective_user.id == admin_chat_id:
+        if len(context.args) < 1:
+            update.message.reply_text("Usage: /editwindow @channel [seconds|default]")
+            return
+        atusername = get_at_username(context.args[0])
+        if atusername not in registered_channels:
+            update.message.reply_text("Channel not registered.")
+            return
+        reg_channel = registered_channels[atusername]
+        if len(context.args) >= 2:
+            if context.args[1] == "default":
+                summary_edit_window = None
+            else:
+                try:
+                    summary_edit_window = max(0.0, float(context.args[1]))
+                except ValueError:
+                    update.message.reply_text("That's not a valid number.")
+                    return
+            with registered_channels.lock(atusername):
+                reg_channel.summary_edit_window = summary_edit_window
+                save_channel(atusername)
+        update.message.reply_text("Summary edit window for {}: {}s".format(
+            atusername, get_summary_edit_window(reg_channel)))
+
+
 def auto_backup():
     if bot_cloud is not None:
-        serialize_bot_data("bot_data.json")
-        file = open("bot_data.json", "rb")
-        result = bot_cloud.send_document(
-            document=file, filename="bot_data.json")
-        bot_cloud.pin_message(result.message_id)
-        file.close()
-        global update_timer
-        try:
-            update_timer.cancel()
-        except RuntimeError:
-            logger.error("Couldn't cancel timer")
-        finally:
-            update_timer = Timer(BACKUP_TIME_DIF * 60, auto_backup)
-            update_timer.start()
+        if backup_lock.acquire(blocking=False):
+            run_backup(None)
+        else:
+            metrics.increment("backups_skipped")
+
+
+def start_backup(chat_id=None):
+    """
+    Uploads a backup to the cloud chat from a scheduler worker.
+
+    Args:
+        chat_id (int): Chat that is also sent the backup
+
+    Returns:
+        bool: False if a backup is already being uploaded
+    """
+    if not backup_lock.acquire(blocking=False):
+        metrics.increment("backups_skipped")
+        return False
+    scheduler.schedule("backup_now", 0, partial(run_backup, chat_id), name="backup", timeout=JOB_TIMEOUT,
+                       dropped=backup_lock.release)
+    return True
+
+
+def run_backup(chat_id):
+    """
+    Uploads a delta with the changes since the last backup, or a new base
+    when there is none yet or the deltas grew too much.
+
+    Args:
+        chat_id (int): Chat that is also sent the backup, or None. Forces
+            a base, since a delta is useless on its own
+    """
+    try:
+        start = monotonic()
+        if bot_cloud is not None:
+            # Changes made while a base is uploaded go in the next delta
+            store.track_backlog()
+        if chat_id is not None or needs_base_backup():
+            upload_base_backup(chat_id)
+        else:
+            upload_delta_backup()
+        metrics.observe("backup", monotonic() - start)
+    except Exception:
+        metrics.increment("backups_failed")
+        logger.exception("Backup failed")
+    finally:
+        backup_lock.release()
+
+
+def shutdown_backup():
+    """
+    Uploads the changes made since the last backup, the database and the
+    journal are on a disk that doesn't outlive the dyno.
+    """
+    if bot_cloud is None:
+        return
+    # Waits for a backup that is already running, but not past the time the
+    # platform gives to shut down, closing the store matters more
+    if not backup_lock.acquire(timeout=SHUTDOWN_BACKUP_WAIT):
+        logger.warning("Skipped the shutdown backup, another one is still running")
+        return
+    run_backup(None)
+
+
+def needs_base_backup():
+    """
+    Returns:
+        bool: Whether the next backup must be a base instead of a delta
+    """
+    if backup_manifest is None:
+        return True
+    deltas = backup_manifest['deltas']
+    # Restoring downloads the base and every delta, start over once the
+    # deltas weigh as much as the base
+    return len(deltas) >= BACKUP_DELTAS_PER_BASE or \
+        sum(delta['bytes'] for delta in deltas) >= backup_manifest['base']['bytes']
+
+
+def upload_base_backup(chat_id):
+    """
+    Args:
+        chat_id (int): Chat that is also sent the backup, or None
+    """
+    start = monotonic()
+    tables = store.read_tables()
+    seq = json.loads(dict(tables["settings"]).get('journal_seq', "0"))
+    metrics.observe("backup_snapshot", monotonic() - start)
+    filename, data = encode_backup(tables)
+    metrics.set("backup_bytes", len(data))
+    metrics.increment("backup_uploaded_bytes", len(data))
+    with outbound_priority(PRIORITY_BULK):
+        if bot_cloud is not None:
+            result = bot_cloud.send_document(document=BytesIO(data), filename=filename)
+            pin_backup_manifest({
+                'manifest': BACKUP_MANIFEST_VERSION,
+                'base': {'file_id': result.document.file_id, 'seq': seq, 'bytes': len(data)},
+                'deltas': []
+            })
+            store.drop_backlog(seq)
+        if chat_id is not None:
+            bot.send_document(chat_id=chat_id, document=BytesIO(data), filename=filename)
+
+
+def upload_delta_backup():
+    entries = store.get_backlog()
+    if len(entries) == 0:
+        metrics.increment("backups_unchanged")
+        return
+    seq = entries[-1][0]
+    data = gzip.compress("\n".join(line for _, line in entries).encode(),
+                         compresslevel=BACKUP_COMPRESSION_LEVEL, mtime=0)
+    metrics.set("backup_delta_bytes", len(data))
+    metrics.increment("backup_uploaded_bytes", len(data))
+    with outbound_priority(PRIORITY_BULK):
+        result = bot_cloud.send_document(document=BytesIO(data), filename=DELTA_FILENAME)
+        pin_backup_manifest(dict(backup_manifest, deltas=backup_manifest['deltas'] + [
+            {'file_id': result.document.file_id, 'seq': seq, 'bytes': len(data)}]))
+    store.drop_backlog(seq)
+
+
+def pin_backup_manifest(manifest):
+    """
+    Args:
+        manifest (dict): The base and deltas to restore, in order
+    """
+    global backup_manifest
+    text = json.dumps(manifest)
+    result = bot_cloud.send_document(document=BytesIO(text.encode()), filename=MANIFEST_FILENAME)
+    bot_cloud.pin_message(result.message_id)
+    metrics.increment("backup_uploaded_bytes", len(text))
+    backup_manifest = manifest
+
+
+def encode_backup(tables):
+    """
+    Args:
+        tables (dict[str, list]): As returned by `BotStore.read_tables`
+
+    Returns:
+        tuple[str, bytes]: File name and contents of the backup, a gzipped
+            bot_data.json or a snapshot depending on BACKUP_FORMAT
+    """
+    start = monotonic()
+    # Sequence numbers and broadcasts only mean something to the run that made the backup
+    tables = dict(tables, settings=[row for row in tables["settings"] if row[0] not in LOCAL_SETTINGS])
+    if BACKUP_FORMAT == "snapshot":
+        filename = SNAPSHOT_FILENAME
+        data = encode_snapshot(tables, SNAPSHOT_COMPRESSION)
+    else:
+        filename = BACKUP_FILENAME
+        text = json.dumps(build_bot_data(tables), cls=BotDataEncoder, indent="\t")
+        data = gzip.compress(text.encode(), compresslevel=BACKUP_COMPRESSION_LEVEL, mtime=0)
+    metrics.observe("backup_encode", monotonic() - start)
+    return filename, data
+
+
+def restore_backup(data):
+    """
+    Replaces everything saved and loaded with a backup.
+
+    Args:
+        data (bytes): A manifest, whose base and deltas are downloaded, or
+            a single backup file
+    """
+    global backup_manifest
+    if data[:len(MANIFEST_MAGIC)] == MANIFEST_MAGIC:
+        manifest = json.loads(data)
+        tables = decode_backup(download_file(manifest['base']['file_id']))
+        entries = []
+        for delta in manifest['deltas']:
+            # Entries may hold line separators other than "\n", which splitlines() would also split on
+            entries.extend(gzip.decompress(download_file(delta['file_id'])).decode().split("\n"))
+        # Messages go straight to the database, each channel loads its own when used
+        store.import_tables(tables, entries, manifest['base']['seq'])
+    else:
+        store.import_tables(decode_backup(data))
+    set_bot_data(store.load(lazy=True))
+    # The next backup starts a chain from what was just restored
+    backup_manifest = None
+
+
+def download_file(file_id):
+    """
+    Args:
+        file_id (str)
+
+    Returns:
+        bytes
+    """
+    return bytes(bot.get_file(file_id).download_as_bytearray())
+
+
+def decode_backup(data):
+    """
+    Args:
+        data (bytes): A snapshot or a bot_data.json backup, gzipped or not
+
+    Returns:
+        dict[str, list]: Rows of each table in STORE_TABLES, messages are
+            left as rows instead of being decoded into objects
+    """
+    if data[:len(SNAPSHOT_MAGIC)] == SNAPSHOT_MAGIC:
+        return decode_snapshot(data)
+    if data[:2] == GZIP_MAGIC:
+        data = gzip.decompress(data)
+    return get_backup_tables(json.loads(data))
+
+
+def encode_snapshot(tables, compression):
+    """
+    Encodes the store's tables column by column, with the strings in
+    "intern" columns written once in a shared table and referenced by index.
+
+    Args:
+        tables (dict[str, list]): Rows of each table in STORE_TABLES
+        compression (str): One of SNAPSHOT_COMPRESSIONS
+
+    Returns:
+        bytes: Header followed by the compressed columns
+    """
+    strings = {}
+    parts = []
+    for table, kinds in SNAPSHOT_COLUMNS[SNAPSHOT_VERSION].items():
+        rows = tables[table]
+        parts.append(SNAPSHOT_COUNT.pack(len(rows)))
+        for kind, column in zip(kinds, zip(*rows) if len(rows) > 0 else [()] * len(kinds)):
+            if kind == "int":
+                parts.append(pack_array("q", column))
+            elif kind == "float":
+                parts.append(pack_array("d", [nan if value is None else value for value in column]))
+            elif kind == "intern":
+                parts.append(pack_array("i", [-1 if value is None else strings.setdefault(value, len(strings))
+                                              for value in column]))
+            else:
+                parts.extend(pack_strings(column))
+    body = b"".join([SNAPSHOT_COUNT.pack(len(strings))] + pack_strings(list(strings)) + parts)
+    compression_id = SNAPSHOT_COMPRESSIONS[compression]
+    metrics.set("backup_raw_bytes", len(body))
+    return SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, compression_id) + \
+        SNAPSHOT_CODECS[compression_id][0](body)
+
+
+def decode_snapshot(data):
+    """
+    Args:
+        data (bytes): As returned by `encode_snapshot`, of this or a previous
+            schema version
+
+    Returns:
+        dict[str, list]: Rows of each table in STORE_TABLES
+    """
+    magic, version, compression_id = SNAPSHOT_HEADER.unpack_from(data)
+    if version > SNAPSHOT_VERSION:
+        raise ValueError("Snapshot schema version {} is newer than {}".format(version, SNAPSHOT_VERSION))
+    if compression_id not in SNAPSHOT_CODECS:
+        raise ValueError("Unknown snapshot compression {}".format(compression_id))
+    reader = SnapshotReader(SNAPSHOT_CODECS[compression_id][1](data[SNAPSHOT_HEADER.size:]))
+
+    strings = reader.read_strings(reader.read_count())
+    tables = {}
+    for table, kinds in SNAPSHOT_COLUMNS[version].items():
+        count = reader.read_count()
+        columns = []
+        for kind in kinds:
+            if kind == "int":
+                columns.append(reader.read_array("q", count))
+            elif kind == "float":
+                columns.append([None if isnan(value) else value for value in reader.read_array("d", count)])
+            elif kind == "intern":
+                columns.append([None if index == -1 else strings[index]
+                                for index in reader.read_array("i", count)])
+            else:
+                columns.append(reader.read_strings(count))
+        tables[table] = list(zip(*columns))
+    for migrate_from in range(version, SNAPSHOT_VERSION):
+        tables = SNAPSHOT_MIGRATIONS[migrate_from](tables)
+    return tables
+
+
+def pack_array(typecode, values):
+    """
+    Args:
+        typecode (str): Of `array.array`
+        values (iterable)
+
+    Returns:
+        bytes: `values` as little endian machine values
+    """
+    packed = array(typecode, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
 
+def pack_strings(values):
+    """
+    Args:
+        values (list of str): May contain None
 
-update_timer = Timer(BACKUP_TIME_DIF * 60, auto_backup)
+    Returns:
+        list of bytes: The lengths of the strings in characters, -1 for None,
+            followed by all of them joined and encoded at once
+    """
+    encoded = "".join(value for value in values if value is not None).encode("utf-8", "surrogatepass")
+    return [pack_array("i", [-1 if value is None else len(value) for value in values]),
+            SNAPSHOT_COUNT.pack(len(encoded)), encoded]
 
 
 def auto_restore():
-    if len(update_checker) == 0 and bot_cloud is not None and bot_cloud.pinned_message is not None:
-        logger.info("Performing data restore.")
-        t_file = bot_cloud.pinned_message.document.get_file()
-        update_checker.append(datetime.now())
-        deserialize_bot_data(t_file.download())
+    """
+    Restores the backup pinned in the cloud chat.
+
+    Returns:
+        bool: False if there is no pinned backup
+    """
+    if bot_cloud is None or bot_cloud.pinned_message is None or bot_cloud.pinned_message.document is None:
+        return False
+    logger.info("Performing data restore.")
+    restore_backup(download_file(bot_cloud.pinned_message.document.file_id))
+    return True
 
 
 def add_to_known_channels(reg_user, channel):
@@ -420,28 +3201,90 @@ def add_to_known_channels(reg_user, channel):
         reg_user (RegisteredUser)
         channel (str)
     """
-    reg_user.known_channels.insert(0, channel)
-    while len(reg_user.known_channels) > MAX_KNOWN_CHANNELS:
-        reg_user.known_channels.pop(-1)
+    reg_user.known_channels.insert(0, channel)
+    while len(reg_user.known_channels) > MAX_KNOWN_CHANNELS:
+        reg_user.known_channels.pop(-1)
+
+
+def schedule_summary(atusername, delay=None):
+    """
+    Schedules the channel's next summary, replacing the one already scheduled.
+
+    Args:
+        atusername (str)
+        delay (float): Seconds, defaults to the time left until the summary
+            is due
+    """
+    if delay is None:
+        reg_channel = registered_channels[atusername]
+        due = reg_channel.last_summary_time + timedelta(hours=reg_channel.template_time_dif)
+        delay = (due - datetime.now()).total_seconds()
+    scheduler.schedule("summary:" + atusername, delay,
+                       partial(submit_channel_work, atusername, partial(try_post_summary, atusername)),
+                       name="summary")
+
+
+def submit_channel_work(atusername, function):
+    """
+    Args:
+        atusername (str)
+        function (callable): Runs on the channel's queue, after the updates
+            and work already submitted for it
+
+    Returns:
+        telegram.ext.utils.promise.Promise: Of `function`, None if the
+            channel isn't registered
+    """
+    reg_channel = registered_channels.get(atusername)
+    if reg_channel is None:
+        return None
+    return channel_queues.submit(reg_channel.chat_id, function)
+
+
+def schedule_summaries():
+    for atusername in registered_channels:
+        schedule_summary(atusername)
 
 
 def try_post_summary(username):
     """
+    Posts the channel's summary when it's due, scheduled by `schedule_summary`.
 
     Args:
         username (str)
 
     """
     atusername = get_at_username(username)
-    reg_channel = registered_channels[atusername]
-
-    delta = datetime.now() - reg_channel.last_summary_time
-    if delta / timedelta(hours=1) >= reg_channel.template_time_dif:
-        post_summary(atusername)
+    with registered_channels.lock(atusername):
+        reg_channel = registered_channels.get(atusername)
+        if reg_channel is None:
+            return
+
+        delta = datetime.now() - reg_channel.last_summary_time
+        if delta / timedelta(hours=1) < reg_channel.template_time_dif:
+            # Posted or rescheduled since this run was scheduled
+            schedule_summary(atusername)
+            return
+        if len(reg_channel.saved_messages) == 0:
+            # Nothing to summarize, the next post schedules it again
+            return
+        metrics.observe("summary_lateness", delta / timedelta(seconds=1) - reg_channel.template_time_dif * 3600)
+    # Runs on the channel's queue, which keeps it from racing with the
+    # channel's posts and edits without holding the lock
+    posted = False
+    try:
+        with outbound_priority(PRIORITY_SUMMARY):
+            posted = post_summary(atusername)
+    finally:
+        if not posted:
+            schedule_summary(atusername, SUMMARY_RETRY_TIME_DIF * 60)
 
 
 def post_summary(channel_username):
     """
+    Sends the summary rendered as posts arrived, uploading its picture
+    while the bot's permissions are checked. Must run on the channel's
+    queue, the Bot API is called without holding the channel's lock.
 
     Args:
         channel_username (str)
@@ -450,33 +3293,97 @@ def post_summary(channel_username):
         bool: True if the message was succesfully posted, False otherwise
     """
     atusername = get_at_username(channel_username)
-    reg_channel = registered_channels[atusername]
-
-    bot_member = get_bot_chat_member(atusername)
-    can_pin = True
-    if not bot_member.can_post_messages:
-        return False
-    if not bot_member.can_edit_messages:
-        can_pin = False
-
-    if reg_channel.template != "":
-        if reg_channel.template_picture is not None and reg_channel.template_picture != "":
-            bot.send_photo(chat_id=reg_channel.chat_id,
-                           photo=reg_channel.template_picture)
+    with registered_channels.lock(atusername):
+        reg_channel = registered_channels.get(atusername)
+        if reg_channel is None or reg_channel.template == "":
+            return False
+        chat_id = reg_channel.chat_id
+        template_picture = reg_channel.template_picture
         text = get_template_string(atusername, reg_channel.saved_messages)
-        summary_id = bot.send_message(chat_id=reg_channel.chat_id,
+
+    start = monotonic()
+    photo = None
+    cached_member = bot_member_cache.get_cached(atusername)
+    # A cached member is checked right away, only a fresh check, which
+    # can't be outdated, is overlapped with the picture
+    if template_picture is not None and template_picture != "" and \
+            (cached_member is None or cached_member.can_post_messages):
+        photo = run_in_background(partial(bot.send_photo, chat_id=chat_id, photo=template_picture))
+    summary_id = None
+    try:
+        try:
+            bot_member = get_bot_chat_member(atusername)
+        finally:
+            if photo is not None:
+                photo.done.wait()
+        if not bot_member.can_post_messages:
+            return False
+        can_pin = bot_member.can_edit_messages
+
+        if photo is not None and photo.exception is not None:
+            raise photo.exception
+        summary_id = bot.send_message(chat_id=chat_id,
                                       text=text,
                                       parse_mode='MarkdownV2',
                                       disable_web_page_preview=True).message_id
         if can_pin:
-            bot.pin_chat_message(reg_channel.chat_id, summary_id)
+            bot.pin_chat_message(chat_id, summary_id)
+    except TelegramError as e:
+        if is_permission_error(e):
+            bot_member_cache.invalidate(atusername)
+        raise
+    finally:
+        # The retry sends the picture again, so it can't be left without its summary
+        if summary_id is None and photo is not None and photo.exception is None:
+            delete_orphan_message(chat_id, photo.result().message_id)
+
+    with registered_channels.lock(atusername):
+        if registered_channels.get(atusername) is not reg_channel:
+            # Unregistered while posting
+            return True
+        reg_channel._post_to_pin = monotonic() - start
+        metrics.observe("summary_post_to_pin", reg_channel._post_to_pin)
         reg_channel.last_summary_message_text = text
         reg_channel.last_summary_message_id = summary_id
         reg_channel.last_saved_messages = reg_channel.saved_messages
-        reg_channel.saved_messages = []
+        reg_channel.saved_messages = MessageStore(
+            categorized=len(reg_channel.categories) > 0)
         reg_channel.last_summary_time = datetime.now()
-        return True
-    return False
+        store.save_posted_summary(atusername, reg_channel)
+        schedule_summary(atusername)
+    return True
+
+
+def delete_orphan_message(chat_id, message_id):
+    """
+    Args:
+        chat_id (int)
+        message_id (int): Message that was sent for a post that failed
+    """
+    try:
+        bot.delete_message(chat_id, message_id)
+    except TelegramError as e:
+        logger.warning("Couldn't delete message %s of %s: %s", message_id, chat_id, e)
+
+
+def run_in_background(function):
+    """
+    Args:
+        function (callable): Makes Bot API calls
+
+    Returns:
+        telegram.ext.utils.promise.Promise: Of `function`, run on a thread of
+            its own with the caller's outbound priority
+    """
+    priority = get_outbound_priority()
+
+    def run():
+        with outbound_priority(priority):
+            return function()
+
+    promise = Promise(run, (), {})
+    Thread(target=promise.run, name="background-call", daemon=True).start()
+    return promise
 
 
 def get_bot_chat_member(chat_username):
@@ -489,9 +3396,32 @@ def get_bot_chat_member(chat_username):
 
     """
     atusername = get_at_username(chat_username)
-    chat: telegram.Chat = bot.get_chat(chat_username)
-    bot_user: telegram.User = bot.get_me()
-    return chat.get_member(bot_user.id)
+    # The bot's own user is fetched once and kept by `Bot.bot`
+    return bot_member_cache.get(atusername, lambda: bot.get_chat_member(atusername, bot.id))
+
+
+def process_my_chat_member(update, context):
+    """
+    Args:
+        update (telegram.Update)
+        context (telegram.ext.CallbackContext)
+    """
+    chat = update.my_chat_member.chat
+    admin_cache.invalidate(chat.id)
+    if chat.username is not None:
+        bot_member_cache.set(get_at_username(chat.username),
+                             update.my_chat_member.new_chat_member)
+
+
+def is_permission_error(e):
+    """
+    Args:
+        e (TelegramError)
+
+    Returns:
+        bool: Whether `e` may be caused by the bot losing rights in the chat
+    """
+    return isinstance(e, (Unauthorized, BadRequest, ChatMigrated))
 
 
 def add_to_last_summary(chat, message):
@@ -511,20 +3441,71 @@ def add_to_last_summary(chat, message):
                          format(atusername))
         return
 
-    reg_channel = registered_channels[atusername]
-    if reg_channel.last_summary_message_id != -1:
+    with registered_channels.lock(atusername):
+        reg_channel = registered_channels.get(atusername)
+        if reg_channel is None or reg_channel.last_summary_message_id == -1:
+            return
         add_to_last_summary_messages(atusername, message)
+    summary_editor.mark_dirty(atusername)
+
+
+def edit_last_summary(username):
+    """
+    Updates the last summary posted in the channel with its latest messages.
+    Must run on the channel's queue, the Bot API is called without holding
+    the channel's lock.
+
+    Args:
+        username (str)
+    """
+    atusername = get_at_username(username)
+    with registered_channels.lock(atusername):
+        reg_channel = registered_channels.get(atusername)
+        if reg_channel is None or reg_channel.last_summary_message_id == -1:
+            return
+        message_id = reg_channel.last_summary_message_id
+
         text = get_template_string(atusername, reg_channel.last_saved_messages)
-        if text != reg_channel.last_summary_message_text:
-            try:
-                bot.edit_message_text(chat_id=chat.id,
-                                      message_id=reg_channel.last_summary_message_id,
-                                      text=text,
-                                      disable_web_page_preview=True,
-                                      parse_mode='MarkdownV2')
-                reg_channel.last_summary_message_text = text
-            except TelegramError:
-                reg_channel.last_summary_message_id = -1
+        if text == reg_channel.last_summary_message_text:
+            metrics.increment("summary_edits_unchanged")
+            return
+    try:
+        bot.edit_message_text(chat_id=reg_channel.chat_id,
+                              message_id=message_id,
+                              text=text,
+                              disable_web_page_preview=True,
+                              parse_mode='MarkdownV2')
+        metrics.increment("summary_edits_sent")
+    except RetryAfter as e:
+        summary_editor.mark_dirty(atusername, e.retry_after)
+        return
+    except TelegramError as e:
+        if is_permission_error(e):
+            bot_member_cache.invalidate(atusername)
+        text = None
+    with registered_channels.lock(atusername):
+        if registered_channels.get(atusername) is not reg_channel or \
+                reg_channel.last_summary_message_id != message_id:
+            return
+        if text is None:
+            reg_channel.last_summary_message_id = -1
+        else:
+            reg_channel.last_summary_message_text = text
+        save_channel(atusername)
+
+
+def get_summary_edit_window(reg_channel):
+    """
+    Args:
+        reg_channel (RegisteredChannel)
+
+    Returns:
+        float: Seconds during which edits to the last summary of `reg_channel`
+            are coalesced
+    """
+    if reg_channel.summary_edit_window is None:
+        return SUMMARY_EDIT_WINDOW
+    return reg_channel.summary_edit_window
 
 
 def get_message_data(username, message):
@@ -551,19 +3532,27 @@ def get_message_data(username, message):
 
     split = text.splitlines()
 
-    if len(reg_channel.categories) > 0:
+    if len(reg_channel.categories) >= PATTERN_MATCHER_MIN_CATEGORIES:
+        if reg_channel._matcher is None:
+            patterns = list(reg_channel.categories)
+            if reg_channel.parts_identifier != "":
+                patterns.append(reg_channel.parts_identifier)
+            reg_channel._matcher = PatternMatcher(patterns)
+        first_lines = reg_channel._matcher.find_first_lines(text, split)
+    else:
+        first_lines = None
+
+    if first_lines is not None:
+        # Every matching category overrides the previous one, so the last
+        # category in the list that appears in the message wins.
+        for cat in reg_channel.categories:
+            if cat in first_lines:
+                category, title = cat, get_title(split, first_lines[cat], cat, title)
+    elif len(reg_channel.categories) > 0:
         for cat in reg_channel.categories:
             for i in range(len(split)):
                 if cat in split[i]:
-                    category = cat
-                    without_cat = split[i].replace(cat, "")
-                    if without_cat != "" and not without_cat.isspace():
-                        title = without_cat
-                    else:
-                        for e in range(i + 1, len(split)):
-                            if split[e] != "" and not split[e].isspace():
-                                title = split[e]
-                                break
+                    category, title = cat, get_title(split, i, cat, title)
                     break
     else:
         for line in split:
@@ -572,10 +3561,14 @@ def get_message_data(username, message):
                 break
 
     if reg_channel.parts_identifier != "":
-        for line in split:
-            if reg_channel.parts_identifier in line:
-                parts = line
-                break
+        if first_lines is not None:
+            if reg_channel.parts_identifier in first_lines:
+                parts = split[first_lines[reg_channel.parts_identifier]]
+        else:
+            for line in split:
+                if reg_channel.parts_identifier in line:
+                    parts = line
+                    break
 
     if len(title) > MAX_CHARACTERS_IN_TITLE:
         title = title[0:MAX_CHARACTERS_IN_TITLE - 1] + "..."
@@ -583,6 +3576,27 @@ def get_message_data(username, message):
     return title, category, parts
 
 
+def get_title(split, i, category, title):
+    """
+    Args:
+        split (list of str): Lines of a message
+        i (int): Line where `category` is
+        category (str)
+        title (str): Kept if there is no title after the category
+
+    Returns:
+        str: The rest of the category's line, or the next line that isn't
+            blank if there is nothing else in it
+    """
+    without_cat = split[i].replace(category, "")
+    if without_cat != "" and not without_cat.isspace():
+        return without_cat
+    for e in range(i + 1, len(split)):
+        if split[e] != "" and not split[e].isspace():
+            return split[e]
+    return title
+
+
 def add_to_saved_messages(username, message):
     """
 
@@ -597,8 +3611,9 @@ def add_to_saved_messages(username, message):
     title, category, parts = get_message_data(atusername, message)
 
     if title != "" and (category != "" or len(reg_channel.categories) == 0):
-        reg_channel.saved_messages.append(
-            SavedMessage(message.message_id, title, category, parts))
+        saved_message = SavedMessage(message.message_id, title, category, parts)
+        add_to_summary_blocks(atusername, reg_channel, reg_channel.saved_messages, saved_message)
+        store.add_message(atusername, saved_message, last=False)
 
 
 def add_to_last_summary_messages(username, message):
@@ -615,85 +3630,214 @@ def add_to_last_summary_messages(username, message):
     title, category, parts = get_message_data(atusername, message)
 
     if title != "" and (category != "" or len(reg_channel.categories) == 0):
-        reg_channel.last_saved_messages.append(
-            SavedMessage(message.message_id, title, category, parts))
+        saved_message = SavedMessage(message.message_id, title, category, parts)
+        add_to_summary_blocks(atusername, reg_channel, reg_channel.last_saved_messages, saved_message)
+        store.add_message(atusername, saved_message, last=True)
 
 
 def get_template_string(username, messages):
     """
     Args:
         username (str)
-        messages (list of SavedMessage)
+        messages (MessageStore)
 
     Returns:
-        str: The formatted template for chanel `username`
+        str: The formatted template for chanel `username`, kept cached in
+            `messages` until they, the template or the render settings change
     """
     atusername = get_at_username(username)
     reg_channel = registered_channels[atusername]
-    template = escape_for_telegram(reg_channel.template)
+    if reg_channel._template_plan is None:
+        reg_channel._template_plan = compile_template(reg_channel)
+    if messages._text is None or messages._text_plan is not reg_channel._template_plan or \
+            messages._text_version != reg_channel._render_version:
+        messages._text = assemble_template(reg_channel, get_summary_blocks(atusername, reg_channel, messages))
+        messages._text_plan = reg_channel._template_plan
+        messages._text_version = reg_channel._render_version
+    return messages._text
+
+
+def get_summary_blocks(atusername, reg_channel, messages):
+    """
+    Args:
+        atusername (str)
+        reg_channel (RegisteredChannel)
+        messages (MessageStore)
+
+    Returns:
+        dict[str, str]: The joined summary lines of each bucket of `messages`,
+            kept cached in `messages` while the channel's render settings
+            don't change
+    """
+    if messages._blocks is None or messages._blocks_version != reg_channel._render_version:
+        messages._blocks = {key: "\n".join([get_message_line(atusername, reg_channel, m)
+                                             for m in bucket])
+                            for key, bucket in messages.buckets.items()}
+        messages._blocks_version = reg_channel._render_version
+    return messages._blocks
+
+
+def add_to_summary_blocks(atusername, reg_channel, messages, message):
+    """
+    Adds `message` to `messages`, formatting only its own line if the summary
+    blocks of `messages` are cached.
+
+    Args:
+        atusername (str)
+        reg_channel (RegisteredChannel)
+        messages (MessageStore)
+        message (SavedMessage)
+    """
+    messages.append(message)
+    if messages._blocks is not None and messages._blocks_version == reg_channel._render_version:
+        key = messages.get_key(message)
+        line = get_message_line(atusername, reg_channel, message)
+        if key in messages._blocks:
+            messages._blocks[key] += "\n" + line
+        else:
+            messages._blocks[key] = line
+
+
+def get_message_line(atusername, reg_channel, m):
+    """
+    Args:
+        atusername (str)
+        reg_channel (RegisteredChannel)
+        m (SavedMessage)
+
+    Returns:
+        str: The formatted summary line of `m`
+    """
+    if m._line_version == reg_channel._render_version:
+        return m._line
+
     parts_id = reg_channel.parts_identifier
     if len(reg_channel.categories) > 0:
-        index = 0
-        for cat in reg_channel.categories:
-            if "$plantilla{}$".format(index) in template:
-                if reg_channel.template_format == "":
-                    cat_messages = ["\\-[{}]({})".format(
-                        escape_for_telegram(m.text.replace(cat, "").strip()),
-                        get_message_link(atusername, m.message_id),) +
-                        ("", "*\\[{}\\]*".format(escape_for_telegram(
-                            m.parts.replace(parts_id, "").strip())))
-                        [reg_channel.parts_identifier != "" and
-                         m.parts.replace(parts_id, "").strip() != ""]
-                        for m in messages
-                        if m.category == cat]
-                else:
-                    cat_messages = [escape_for_telegram(reg_channel.template_format).replace(
-                                    escape_for_telegram("{titulo}"), "[{}]({})".format(
-                                        escape_for_telegram(
-                                            m.text.replace(cat, "").strip()),
-                                        get_message_link(atusername, m.message_id),)).replace(
-                                            escape_for_telegram("{partes}"),
-                                            ("", "*\\[{}\\]*".format(escape_for_telegram(
-                                                m.parts.replace(parts_id, "").strip())))
-                                            [reg_channel.parts_identifier != "" and
-                                             m.parts.replace(parts_id, "").strip() != ""])
-                                    for m in messages
-                                    if m.category == cat]
-                if len(cat_messages) > 0:
-                    template = template.replace(
-                        "$plantilla{}$".format(index), "\n".join(cat_messages))
-                else:
-                    template = template.replace(
-                        "$plantilla{}$".format(index), "\\-")
-            index += 1
-    elif "$plantilla$" in template:
-        if len(messages) > 0:
-            if reg_channel.template_format == "":
-                final_messages = ["\\-[{}]({})".format(
-                    escape_for_telegram(m.text.strip()),
-                    get_message_link(atusername, m.message_id), ) +
-                    ("", "*\\[{}\\]*".format(escape_for_telegram(
-                        m.parts.replace(parts_id, "").strip())))
-                    [reg_channel.parts_identifier != "" and
-                     m.parts.replace(parts_id, "").strip() != ""]
-                    for m in messages]
-            else:
-                final_messages = [escape_for_telegram(reg_channel.template_format).replace(
-                    escape_for_telegram("{titulo}"), "[{}]({})".format(
-                        escape_for_telegram(m.text.strip()),
-                        get_message_link(atusername, m.message_id), )).replace(
-                    escape_for_telegram("{partes}"),
+        title = m.text.replace(m.category, "").strip()
+    else:
+        title = m.text.strip()
+    if reg_channel.template_format == "":
+        line = "\\-[{}]({})".format(
+            escape_for_telegram(title),
+            get_message_link(atusername, m.message_id),) + \
+            ("", "*\\[{}\\]*".format(escape_for_telegram(
+                m.parts.replace(parts_id, "").strip())))[
+                reg_channel.parts_identifier != "" and
+                m.parts.replace(parts_id, "").strip() != ""]
+    else:
+        line = escape_for_telegram_cached(reg_channel.template_format).replace(
+            escape_for_telegram_cached("{titulo}"), "[{}]({})".format(
+                escape_for_telegram(title),
+                get_message_link(atusername, m.message_id),)).replace(
+                    escape_for_telegram_cached("{partes}"),
                     ("", "*\\[{}\\]*".format(escape_for_telegram(
                         m.parts.replace(parts_id, "").strip())))
                     [reg_channel.parts_identifier != "" and
                      m.parts.replace(parts_id, "").strip() != ""])
-                    for m in messages]
-            template = template.replace(
-                "$plantilla$", "\n".join(final_messages))
+
+    m._line = line
+    m._line_version = reg_channel._render_version
+    return line
+
+
+def assemble_template(reg_channel, blocks):
+    """
+    Args:
+        reg_channel (RegisteredChannel)
+        blocks (dict[str, str]): As returned by `get_summary_blocks`
+
+    Returns:
+        str: The template of `reg_channel` filled with `blocks`
+    """
+    if reg_channel._template_plan is None:
+        reg_channel._template_plan = compile_template(reg_channel)
+    plan = reg_channel._template_plan
+
+    pieces = []
+    for piece in plan:
+        if isinstance(piece, TemplateSlot):
+            block = blocks.get(piece.key, "\\-")
+            if "$" in block and len(reg_channel.categories) > 0:
+                # A block could carry a later $plantilla#$ tag, which the
+                # tag by tag replacement would also fill in.
+                return assemble_template_sequentially(reg_channel, blocks)
+            pieces.append(block)
+        else:
+            pieces.append(piece)
+    return "".join(pieces)
+
+
+def compile_template(reg_channel):
+    """
+    Args:
+        reg_channel (RegisteredChannel)
+
+    Returns:
+        list of (str or TemplateSlot): The escaped template of `reg_channel`
+            split into literal text and the slots where category blocks go
+    """
+    template = escape_for_telegram_cached(reg_channel.template)
+    plan = [template]
+    if len(reg_channel.categories) > 0:
+        # Tags are split out in category order so that overlapping tags
+        # resolve the same way as replacing them one after the other.
+        for index, cat in enumerate(reg_channel.categories):
+            tag = "$plantilla{}$".format(index)
+            plan = split_template_plan(plan, tag, cat)
+    else:
+        plan = split_template_plan(plan, "$plantilla$", "")
+    plan.append(SUMMARY_SIGNATURE)
+
+    compiled = []
+    for piece in plan:
+        if isinstance(piece, str) and len(compiled) > 0 and isinstance(compiled[-1], str):
+            compiled[-1] += piece
+        elif piece != "":
+            compiled.append(piece)
+    return compiled
+
+
+def split_template_plan(plan, tag, key):
+    """
+    Args:
+        plan (list of (str or TemplateSlot))
+        tag (str)
+        key (str)
+
+    Returns:
+        list of (str or TemplateSlot): `plan` with every `tag` in its literal
+            text replaced by a slot for `key`
+    """
+    result = []
+    for piece in plan:
+        if isinstance(piece, str) and tag in piece:
+            split = piece.split(tag)
+            result.append(split[0])
+            for literal in split[1:]:
+                result.append(TemplateSlot(key))
+                result.append(literal)
         else:
-            template = template.replace("$plantilla$", "\\-")
-    template += "\n🤖📝 [\\[Bot de Resúmenes\\]](t.me/ForceGamesHelperBot) 📝🤖"
-    return template
+            result.append(piece)
+    return result
+
+
+def assemble_template_sequentially(reg_channel, blocks):
+    """
+    Args:
+        reg_channel (RegisteredChannel)
+        blocks (dict[str, str]): As returned by `get_summary_blocks`
+
+    Returns:
+        str: The template of `reg_channel` filled with `blocks` one tag at a time
+    """
+    template = escape_for_telegram_cached(reg_channel.template)
+    index = 0
+    for cat in reg_channel.categories:
+        if "$plantilla{}$".format(index) in template:
+            template = template.replace(
+                "$plantilla{}$".format(index), blocks.get(cat, "\\-"))
+        index += 1
+    return template + SUMMARY_SIGNATURE
 
 
 def escape_for_telegram(text):
@@ -726,6 +3870,21 @@ def escape_for_telegram(text):
         .replace('~', '\\~')
 
 
+@lru_cache(maxsize=ESCAPE_CACHE_SIZE)
+def escape_for_telegram_cached(text):
+    """
+    Same as `escape_for_telegram`, for strings that are escaped on every
+    render such as templates, formats and their tags.
+
+    Args:
+        text (str)
+
+    Returns:
+        str: Escaped text
+    """
+    return escape_for_telegram(text)
+
+
 def get_message_link(chat_username, message_id):
     """
     Args:
@@ -781,10 +3940,13 @@ def get_reg_user(user, chat):
         RegisteredUser: Finds or creates a new registered user
     """
     str_id = str(user.id)
-    if str_id not in registered_users:
-        registered_users[str_id] = RegisteredUser(chat_id=chat.id)
-
-    return registered_users[str_id]
+    with registered_users.lock(str_id):
+        reg_user = registered_users.get(str_id)
+        if reg_user is None:
+            reg_user = registered_users.setdefault(str_id, RegisteredUser(chat_id=chat.id))
+        # Keeps cleanup from forgetting a user while its update is handled
+        reg_user.last_seen = datetime.now()
+    return reg_user
 
 
 def go_to_base(update, context):
@@ -830,8 +3992,7 @@ def customize_channel(update, context):
     atusername = get_at_username(update.message.text)
     try:
         if atusername in registered_channels:
-            admin_status = is_admin(bot.get_chat(
-                atusername), update.effective_user.id)
+            admin_status = is_admin(get_chat(atusername), update.effective_user.id)
             if admin_status[0]:
                 go_to_customization(update, context)
                 reg_user.context_data['channel'] = atusername
@@ -905,7 +4066,7 @@ def get_categories_list_text(reg_channel, highlight: Optional[int] = -1):
         ("", "__*")[highlight == i],
         i,
         ("\\", "")[highlight == -1],
-        (escape_for_telegram(reg_channel.categories[i]), reg_channel.categories[i])[
+        (escape_for_telegram_cached(reg_channel.categories[i]), reg_channel.categories[i])[
             highlight == -1],
         ("", "*__")[highlight == i])
         for i in range(len(reg_channel.categories))])
@@ -999,7 +4160,10 @@ def change_format(update, context):
     reg_user = get_reg_user(update.effective_user, update.effective_chat)
     reg_channel = registered_channels[reg_user.context_data['channel']]
     if "{titulo}" in update.message.text:
-        reg_channel.template_format = update.message.text
+        with registered_channels.lock(reg_user.context_data['channel']):
+            reg_channel.template_format = update.message.text
+            reg_channel.invalidate_render_cache()
+            save_channel(reg_user.context_data['channel'])
         update.message.reply_text("Formato cambiado! :D")
         go_to_customization(update, context)
     else:
@@ -1018,7 +4182,10 @@ def delete_format(update, context):
     reg_user = get_reg_user(update.effective_user, update.effective_chat)
     reg_channel = registered_channels[reg_user.context_data['channel']]
     if reg_channel.template_format != "":
-        reg_channel.template_format = ""
+        with registered_channels.lock(reg_user.context_data['channel']):
+            reg_channel.template_format = ""
+            reg_channel.invalidate_render_cache()
+            save_channel(reg_user.context_data['channel'])
         update.message.reply_text("Formato eliminado, usa {} para crear uno nuevo.".format(
             CHANGE_TEMPLATE_FORMAT_MARKUP))
     else:
@@ -1053,7 +4220,11 @@ def change_parts_id(update, context):
     """
     reg_user = get_reg_user(update.effective_user, update.effective_chat)
     reg_channel = registered_channels[reg_user.context_data['channel']]
-    reg_channel.parts_identifier = update.message.text
+    with registered_channels.lock(reg_user.context_data['channel']):
+        reg_channel.parts_identifier = update.message.text
+        reg_channel.invalidate_render_cache()
+        reg_channel.invalidate_matcher()
+        save_channel(reg_user.context_data['channel'])
     update.message.reply_text("Identificador cambiado! :D")
     go_to_customization(update, context)
 
@@ -1069,7 +4240,11 @@ def delete_parts_id(update, context):
     reg_user = get_reg_user(update.effective_user, update.effective_chat)
     reg_channel = registered_channels[reg_user.context_data['channel']]
     if reg_channel.parts_identifier != "":
-        reg_channel.parts_identifier = ""
+        with registered_channels.lock(reg_user.context_data['channel']):
+            reg_channel.parts_identifier = ""
+            reg_channel.invalidate_render_cache()
+            reg_channel.invalidate_matcher()
+            save_channel(reg_user.context_data['channel'])
         update.message.reply_text(
             "Identificador eliminado, usa {} para crear uno nuevo.".format(CHANGE_PARTS_ID_MARKUP))
     else:
@@ -1086,7 +4261,9 @@ def delete_template_picture(update, context):
     reg_user = get_reg_user(update.effective_user, update.effective_chat)
     reg_channel = registered_channels[reg_user.context_data['channel']]
     if reg_channel.template != "":
-        reg_channel.template_picture = ""
+        with registered_channels.lock(reg_user.context_data['channel']):
+            reg_channel.template_picture = ""
+            save_channel(reg_user.context_data['channel'])
         update.message.reply_text("Foto eliminada, usa {} para establecer una nueva.".format(
             CHANGE_TEMPLATE_PICTURE_MARKUP))
     else:
@@ -1161,7 +4338,13 @@ def add_category(update, context):
         return
     reg_user = get_reg_user(update.effective_user, update.effective_chat)
     reg_channel = registered_channels[reg_user.context_data['channel']]
-    reg_channel.categories.append(update.message.text)
+    with registered_channels.lock(reg_user.context_data['channel']):
+        reg_channel.categories.append(intern_string(update.message.text))
+        reg_channel.invalidate_render_cache()
+        reg_channel.update_message_buckets()
+        reg_channel.invalidate_template_plan()
+        reg_channel.invalidate_matcher()
+        save_channel(reg_user.context_data['channel'])
     update.message.reply_text(
         "Categoría {} añadida! Para que esta funcione $plantilla{}$ debe estar en el texto de la plantilla"
         .format(update.message.text, len(reg_channel.categories) - 1))
@@ -1209,7 +4392,13 @@ def remove_category(update, context):
         update.message.reply_text("Eso no es un número válido :c")
         return
 
-    reg_channel.categories.pop(index)
+    with registered_channels.lock(reg_user.context_data['channel']):
+        reg_channel.categories.pop(index)
+        reg_channel.invalidate_render_cache()
+        reg_channel.update_message_buckets()
+        reg_channel.invalidate_template_plan()
+        reg_channel.invalidate_matcher()
+        save_channel(reg_user.context_data['channel'])
     update.message.reply_text("Categoría eliminada.")
     go_to_categories(update, context)
 
@@ -1313,9 +4502,12 @@ def move_category_up(update, context):
         update.message.reply_text("No se puede mover más arriba.")
     else:
         index -= 1
-        item = reg_channel.categories[index]
-        reg_channel.categories.pop(index)
-        reg_channel.categories.insert(index + 1, item)
+        with registered_channels.lock(reg_user.context_data['channel']):
+            item = reg_channel.categories[index]
+            reg_channel.categories.pop(index)
+            reg_channel.categories.insert(index + 1, item)
+            reg_channel.invalidate_template_plan()
+            save_channel(reg_user.context_data['channel'])
         if index == 0:
             markup = ReplyKeyboardMarkup(
                 [
@@ -1361,9 +4553,12 @@ def move_category_down(update, context):
         update.message.reply_text("No se puede mover más abajo.")
     else:
         index += 1
-        item = reg_channel.categories[index - 1]
-        reg_channel.categories.pop(index - 1)
-        reg_channel.categories.insert(index, item)
+        with registered_channels.lock(reg_user.context_data['channel']):
+            item = reg_channel.categories[index - 1]
+            reg_channel.categories.pop(index - 1)
+            reg_channel.categories.insert(index, item)
+            reg_channel.invalidate_template_plan()
+            save_channel(reg_user.context_data['channel'])
         if index == len(reg_channel.categories) - 1:
             markup = ReplyKeyboardMarkup(
                 [
@@ -1416,8 +4611,11 @@ def change_template(update, context):
         context (telegram.ext.CallbackContext)
     """
     reg_user = get_reg_user(update.effective_user, update.effective_chat)
-    registered_channels[reg_user.context_data['channel']
-                        ].template = update.message.text
+    reg_channel = registered_channels[reg_user.context_data['channel']]
+    with registered_channels.lock(reg_user.context_data['channel']):
+        reg_channel.template = update.message.text
+        reg_channel.invalidate_template_plan()
+        save_channel(reg_user.context_data['channel'])
     update.message.reply_text("Plantilla cambiada! :3")
     go_to_customization(update, context)
 
@@ -1461,8 +4659,10 @@ def change_template_picture(update, context):
         context (telegram.ext.CallbackContext)
     """
     reg_user = get_reg_user(update.effective_user, update.effective_chat)
-    registered_channels[reg_user.context_data['channel']
-                        ].template_picture = update.message.photo[-1].file_id
+    with registered_channels.lock(reg_user.context_data['channel']):
+        registered_channels[reg_user.context_data['channel']
+                            ].template_picture = update.message.photo[-1].file_id
+        save_channel(reg_user.context_data['channel'])
     update.message.reply_text("Foto establecida! :3")
     go_to_customization(update, context)
 
@@ -1513,8 +4713,11 @@ def change_summary_time(update, context):
         if time <= 0:
             update.message.reply_text("Eso no es un número válido :/")
         else:
-            registered_channels[reg_user.context_data['channel']
-                                ].template_time_dif = time
+            with registered_channels.lock(reg_user.context_data['channel']):
+                registered_channels[reg_user.context_data['channel']
+                                    ].template_time_dif = time
+                save_channel(reg_user.context_data['channel'])
+                schedule_summary(reg_user.context_data['channel'])
             update.message.reply_text("Tiempo entre resumenes cambiado :3")
     except ValueError:
         update.message.reply_text("Eso no es un número válido :/")
@@ -1551,7 +4754,7 @@ def register_channel(update, context):
         go_to_base(update, context)
         return
     try:
-        channel = bot.get_chat(atusername)
+        channel = get_chat(atusername)
     except TelegramError:
         update.message.reply_text(
             "No se encontró el canal :|")
@@ -1563,9 +4766,13 @@ def register_channel(update, context):
         return
     admin_status = is_admin(channel, update.effective_user.id)
     if admin_status[0]:
-        registered_channels[atusername] = RegisteredChannel(chat_id=channel.id)
-        add_to_known_channels(get_reg_user(
-            update.effective_user, update.effective_chat), atusername)
+        with registered_channels.lock(atusername):
+            registered_channels[atusername] = RegisteredChannel(chat_id=channel.id)
+            save_channel(atusername)
+            schedule_summary(atusername)
+        reg_user = get_reg_user(update.effective_user, update.effective_chat)
+        with registered_users.lock(str(update.effective_user.id)):
+            add_to_known_channels(reg_user, atusername)
         update.message.reply_text(
             "Canal registrado! :D Ahora en el menú debes configurar la plantilla antes de que pueda ser usada 📄")
         go_to_base(update, context)
@@ -1599,14 +4806,17 @@ def unregister_channel(update, context):
     """
     channel = update.message.text
     if channel in registered_channels:
-        admin_status = is_admin(bot.get_chat(
-            channel), update.effective_user.id)
+        admin_status = is_admin(get_chat(channel), update.effective_user.id)
         if admin_status[0]:
             reg_user = get_reg_user(
                 update.effective_user, update.effective_chat)
-            registered_channels.pop(channel)
-            if channel in reg_user.known_channels:
-                reg_user.known_channels.remove(channel)
+            with registered_channels.lock(channel):
+                registered_channels.pop(channel)
+                store.delete_channel(channel)
+                scheduler.cancel("summary:" + channel)
+            with registered_users.lock(str(update.effective_user.id)):
+                if channel in reg_user.known_channels:
+                    reg_user.known_channels.remove(channel)
             update.message.reply_text(
                 "Canal eliminado del registro satisfactoriamente (satisfactorio para ti, pvto) ;-;")
             go_to_base(update, context)
@@ -1625,8 +4835,12 @@ def send_summary_now(update, context):
         context (telegram.ext.CallbackContext)
     """
     reg_user = get_reg_user(update.effective_user, update.effective_chat)
-    post_summary(reg_user.context_data['channel'])
-    update.message.reply_text("Resumen enviado :D")
+    atusername = reg_user.context_data['channel']
+    promise = submit_channel_work(atusername, partial(post_summary, atusername))
+    if promise is not None:
+        promise.result()
+        if promise.exception is None:
+            update.message.reply_text("Resumen enviado :D")
 
 
 def is_admin(from_chat, user_id) -> tuple[bool, str]:
@@ -1643,30 +4857,58 @@ def is_admin(from_chat, user_id) -> tuple[bool, str]:
         return True, ""
     if from_chat.type == "channel":
         try:
-            bot_user: telegram.User = bot.get_me()
-            bot_member = from_chat.get_member(bot_user.id)
-            administrators = from_chat.get_administrators()
-            if bot_member is not None:
-                if bot_member not in administrators:
-                    return False, "El bot no es administrador del canal"
-                elif not bot_member.can_post_messages:
-                    return False, "El bot no tiene permiso de publicar mensajes en el canal"
-            else:
-                return False, "El bot no pertenece al canal"
-            member = from_chat.get_member(user_id)
-            if member is not None:
-                if member in administrators:
-                    return True, ""
-                else:
-                    return False, "No eres administrador de ese canal :/ eres tonto o primo de JAVIER?"
+            administrators = get_chat_administrators(from_chat)
+            bot_member = administrators.get(bot.id)
+            if bot_member is None:
+                return False, "El bot no es administrador del canal"
+            elif not bot_member.can_post_messages:
+                return False, "El bot no tiene permiso de publicar mensajes en el canal"
+            if user_id in administrators:
+                return True, ""
+            # Only asked to tell apart users that aren't in the channel at all
+            if from_chat.get_member(user_id) is not None:
+                return False, "No eres administrador de ese canal :/ eres tonto o primo de JAVIER?"
             else:
                 return False, "No perteneces a ese canal"
         except TelegramError:
+            admin_cache.invalidate(from_chat.id)
             return False, "No perteneces a este canal, o el bot no pertenece a este"
     else:
         return False, "Ese chat no es un canal"
 
 
+def get_chat_administrators(chat):
+    """
+    Args:
+        chat (telegram.Chat)
+
+    Returns:
+        dict[int, telegram.ChatMember]: The administrators of `chat` by user id
+    """
+    return admin_cache.get(chat.id, lambda: {member.user.id: member
+                                             for member in chat.get_administrators()})
+
+
+def get_chat(username):
+    """
+    Args:
+        username (str)
+
+    Returns:
+        telegram.Chat: The chat with `username`, cached for a short time
+    """
+    return chat_cache.get(get_at_username(username), lambda: bot.get_chat(username))
+
+
+def process_chat_member(update, context):
+    """
+    Args:
+        update (telegram.Update)
+        context (telegram.ext.CallbackContext)
+    """
+    admin_cache.invalidate(update.chat_member.chat.id)
+
+
 def help_handler(update, context):
     """
     Args:
@@ -1685,11 +4927,8 @@ def backup(update, context):
     """
     if update.effective_chat.id != admin_chat_id:
         return
-    auto_backup()
-    file = open("bot_data.json", "rb")
-    bot.send_document(chat_id=update.effective_chat.id,
-                      document=file, filename="bot_data.json")
-    file.close()
+    if not start_backup(update.effective_chat.id):
+        update.message.reply_text("A backup is already being uploaded.")
 
 
 def restore(update, context):
@@ -1703,7 +4942,8 @@ def restore(update, context):
         t_file = original.document.get_file()
         deserialize_bot_data(t_file.download())
         update.message.reply_text("Restored previous data!")
-        update_checker[0] = datetime.now()
+        global last_restore_time
+        last_restore_time = datetime.now()
     else:
         update.message.reply_text(
             "That command must be a reply to the backup file")
@@ -1715,32 +4955,122 @@ def deserialize_bot_data(filename):
         filename (str)
     """
     try:
-        file = open(filename, "r")
-        dct = json.load(file, object_hook=decode_bot_data)
-        global admin_chat_id, registered_channels, registered_users
-        admin_chat_id = dct['admin_id']
-        registered_channels = dct['registered_channels']
-        registered_users = dct['registered_users']
+        file = open(filename, "rb")
+        data = file.read()
         file.close()
-        return True
     except OSError:
         logger.warning("Could not load bot data.")
         return False
+    restore_backup(data)
+    return True
+
+
+def load_bot_data():
+    """
+    Returns:
+        bool: False if nothing was saved in the database yet
+    """
+    if store.is_empty():
+        return False
+    set_bot_data(store.load(lazy=True))
+    return True
 
 
-def serialize_bot_data(filename):
+def set_bot_data(dct):
     """
     Args:
-        filename (str)
+        dct (dict): As loaded from a backup or the database
     """
-    file = open(filename, "w")
-    bot_data = {
-        'admin_id': admin_chat_id,
-        'registered_channels': registered_channels,
-        'registered_users': registered_users
-    }
-    json.dump(bot_data, file, cls=BotDataEncoder, indent="\t")
-    file.close()
+    global admin_chat_id
+    admin_chat_id = dct['admin_id']
+    registered_channels.replace(dct['registered_channels'])
+    registered_users.replace(dct['registered_users'])
+    schedule_summaries()
+
+
+def save_channel(atusername):
+    """
+    Args:
+        atusername (str): Registered channel to write to the database
+    """
+    store.save_channel(atusername, registered_channels[atusername])
+
+
+def startup():
+    """
+    Loads the bot's data once, before any update is handled, from the
+    database or, if there is none, from the cloud chat.
+    """
+    global last_restore_time
+    try:
+        # A database left by a previous run is newer than the pinned cloud backup
+        with startup_phase("database_load"):
+            loaded = load_bot_data()
+        if not loaded:
+            with startup_phase("cloud_restore"):
+                loaded = auto_restore()
+        if loaded:
+            last_restore_time = datetime.now()
+        bot_ready.set()
+    finally:
+        # Releases the updates waiting for the data, which are dropped if
+        # it couldn't be loaded
+        startup_finished.set()
+
+
+@contextmanager
+def startup_phase(name):
+    """
+    Times and logs a phase of the startup.
+
+    Args:
+        name (str)
+    """
+    start = monotonic()
+    try:
+        yield
+    finally:
+        duration = monotonic() - start
+        metrics.observe("startup_" + name, duration)
+        logger.info("Startup phase %s took %.3fs", name, duration)
+
+
+def wait_until_ready(update, context):
+    """
+    Holds the dispatcher, and with it the updates queued behind this one,
+    until startup loaded the data. Drops the update if startup failed, so
+    that nothing is saved over data that wasn't loaded.
+
+    Args:
+        update (telegram.Update)
+        context (telegram.ext.CallbackContext)
+    """
+    if not bot_ready.is_set():
+        start = monotonic()
+        startup_finished.wait()
+        if not bot_ready.is_set():
+            raise DispatcherHandlerStop()
+        metrics.set("startup_updates_queued", context.dispatcher.update_queue.qsize() + 1)
+        metrics.observe("startup_update_wait", monotonic() - start)
+
+
+def persist_user(update, context):
+    """
+    Writes the user that sent the update to the database after the handlers
+    of the previous group changed it, along with when it was last seen.
+
+    Args:
+        update (telegram.Update)
+        context (telegram.ext.CallbackContext)
+    """
+    user = update.effective_user
+    if user is not None:
+        str_id = str(user.id)
+        with registered_users.lock(str_id):
+            reg_user = registered_users.get(str_id)
+            if reg_user is not None:
+                reg_user.last_seen = datetime.now()
+                store.save_user(str_id, reg_user)
 
 
 def process_private_message(update, context):
@@ -1751,7 +5081,6 @@ def process_private_message(update, context):
     """
     if update.message is None:
         return
-    auto_restore()
     reg_user = get_reg_user(update.effective_user, update.effective_chat)
     status = reg_user.status
     text = update.message.text
@@ -1895,7 +5224,6 @@ def process_private_photo(update, context):
     """
     if update.message is None:
         return
-    auto_restore()
     reg_user = get_reg_user(update.effective_user, update.effective_chat)
     status = reg_user.status
     if status == "requested_template_picture":
@@ -1906,25 +5234,43 @@ def process_private_photo(update, context):
 
 def process_channel_update(update, context):
     """
+    Queues the post behind the channel's previous updates.
 
     Args:
         update (telegram.Update)
         context (telegram.ext.CallbackContext)
 
     """
-    auto_restore()
     if update.channel_post is None:
         return
+    channel_queues.submit(update.effective_chat.id, partial(process_channel_post, update))
+
+
+def process_channel_post(update):
+    """
 
+    Args:
+        update (telegram.Update)
+
+    """
     chat = update.effective_chat
     atusername = get_at_username(chat.username)
-    if atusername not in registered_channels:
-        return
-    reg_channel = registered_channels[atusername]
-    add_to_saved_messages(atusername, update.channel_post)
-    add_to_last_summary(chat, update.channel_post)
-
-    try_post_summary(atusername)
+    with registered_channels.lock(atusername):
+        if atusername not in registered_channels:
+            return
+        reg_channel = registered_channels[atusername]
+        add_to_saved_messages(atusername, update.channel_post)
+        if reg_channel.template != "":
+            # Renders the next summary now, so posting it is just sending it
+            get_template_string(atusername, reg_channel.saved_messages)
+
+        if not scheduler.is_scheduled("summary:" + atusername):
+            # It was due with nothing to summarize
+            schedule_summary(atusername)
+    # Checks the bot's rights and may edit the last summary, without
+    # holding the lock other channels on its stripe wait for
+    with outbound_priority(PRIORITY_SUMMARY):
+        add_to_last_summary(chat, update.channel_post)
 
 
 def error(update, context):
@@ -1946,17 +5292,24 @@ def fix(update, context):
             if not ch.islower():
                 tofix.append(ch)
         for ch in tofix:
-            registered_channels[ch.lower()] = registered_channels[ch]
-            registered_channels.pop(ch)
+            with registered_channels.lock(ch.lower()):
+                reg_channel = registered_channels[ch]
+                # Its messages are loaded by username, which is about to change
+                reg_channel.load_messages()
+                registered_channels[ch.lower()] = reg_channel
+                registered_channels.pop(ch)
+                store.rename_channel(ch, ch.lower())
+                scheduler.cancel("summary:" + ch)
+                schedule_summary(ch.lower())
         update.message.reply_text("Fixed!")
 
 
 def main():
     """Start the bot."""
-    # Create the Updater and pass it your bot's token.
+    # Create the Updater with the shared bot, so that replies go through the rate limiter.
     # Make sure to set use_context=True to use the new context based callbacks
     # Post version 12 this will no longer be necessary
-    updater = Updater(TOKEN, use_context=True)
+    updater = Updater(bot=bot, workers=DISPATCHER_WORKERS, use_context=True)
 
     # Get the dispatcher to register handlers
     dp = updater.dispatcher
@@ -1971,6 +5324,8 @@ def main():
     dp.add_handler(CommandHandler("getchatid", get_chat_id))
     dp.add_handler(CommandHandler("stats", stats))
     dp.add_handler(CommandHandler("fix", fix))
+    dp.add_handler(CommandHandler("editwindow", edit_window))
+    dp.add_handler(CommandHandler("cleanup", cleanup_command))
 
     dp.add_handler(MessageHandler(
         Filters.text & Filters.chat_type.private, process_private_message))
@@ -1979,23 +5334,46 @@ def main():
 
     dp.add_handler(MessageHandler(Filters.chat_type.channel & (Filters.text | Filters.caption),
                                   process_channel_update))
+    dp.add_handler(ChatMemberHandler(process_my_chat_member, ChatMemberHandler.MY_CHAT_MEMBER))
+    dp.add_handler(ChatMemberHandler(process_chat_member, ChatMemberHandler.CHAT_MEMBER))
+    dp.add_handler(TypeHandler(Update, persist_user), group=1)
 
-    auto_restore()
-    auto_backup()
+    dp.add_handler(TypeHandler(Update, wait_until_ready), group=-1)
 
     # log all errors
     dp.add_error_handler(error)
 
-    # Start the Bot
-    updater.start_webhook(listen="0.0.0.0",
-                          port=int(PORT),
-                          url_path=TOKEN,
-                          webhook_url='https://forcegameshelper.herokuapp.com/' + TOKEN)
+    # Start the Bot, the port is bound right away so that a slow restore
+    # doesn't exceed the platform's boot timeout, updates queue until ready
+    started = monotonic()
+    with startup_phase("webhook"):
+        updater.start_webhook(listen="0.0.0.0",
+                              port=int(PORT),
+                              url_path=TOKEN,
+                              allowed_updates=Update.ALL_TYPES,
+                              webhook_url='https://forcegameshelper.herokuapp.com/' + TOKEN)
+    try:
+        startup()
+    except Exception:
+        # Running on without the data would back that up over the pinned backup
+        logger.exception("Startup restore failed")
+        updater.stop()
+        scheduler.stop()
+        store.close()
+        raise
+    resume_broadcast()
+    scheduler.every("backup", BACKUP_TIME_DIF * 60, auto_backup, SCHEDULER_JITTER, JOB_TIMEOUT, delay=0)
+    scheduler.every("cleanup", CLEANUP_TIME_DIF * 60, auto_cleanup, SCHEDULER_JITTER, JOB_TIMEOUT)
+    scheduler.every("cache_purge", CACHE_PURGE_TIME_DIF * 60, purge_caches, SCHEDULER_JITTER)
+    logger.info("Started in %.3fs", monotonic() - started)
 
     if admin_chat_id != -1:
         bot.send_message(admin_chat_id, "Bot started")
 
     updater.idle()
+    scheduler.stop()
+    shutdown_backup()
+    store.close()
 
 
 if __name__ == '__main__':
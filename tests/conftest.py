@@ -0,0 +1,47 @@
+import importlib.util
+import os
+from types import SimpleNamespace
+
+import pytest
+
+MODULE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "forcegameshelper.py")
+
+
+@pytest.fixture
+def fgh(tmp_path, monkeypatch):
+    """
+    forcegameshelper loaded anew for each test, with a dummy token and its
+    own database and journal.
+    """
+    monkeypatch.setenv("TOKEN", "123456:ABCDEF")
+    monkeypatch.setenv("DATABASE_PATH", str(tmp_path / "bot_data.db"))
+    monkeypatch.setenv("JOURNAL_PATH", str(tmp_path / "bot_data.journal"))
+    monkeypatch.delenv("BOT_CLOUD", raising=False)
+    spec = importlib.util.spec_from_file_location("forcegameshelper", MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    yield module
+    module.scheduler.stop()
+    module.store.close()
+
+
+class FakeCloud:
+    """
+    Cloud chat that keeps the documents sent to it.
+    """
+    def __init__(self):
+        self.files = {}
+
+    def send_document(self, document, filename):
+        file_id = "file{}".format(len(self.files))
+        self.files[file_id] = (filename, document.read())
+        return SimpleNamespace(message_id=len(self.files), document=SimpleNamespace(file_id=file_id))
+
+    def pin_message(self, message_id):
+        pass
+
+
+@pytest.fixture
+def cloud(fgh):
+    fgh.bot_cloud = FakeCloud()
+    return fgh.bot_cloud
@@ -0,0 +1,33 @@
+def test_stop_releases_backup_lock_of_queued_backup(fgh, cloud):
+    # Without workers the backup stays queued
+    fgh.scheduler = fgh.JobScheduler(0)
+    assert fgh.start_backup()
+    assert fgh.backup_lock.locked()
+
+    fgh.scheduler.stop()
+
+    assert not fgh.backup_lock.locked()
+    fgh.shutdown_backup()
+    assert not fgh.backup_lock.locked()
+    assert [filename for filename, _ in cloud.files.values()] == [fgh.BACKUP_FILENAME, fgh.MANIFEST_FILENAME]
+
+
+def test_cancel_and_replace_call_dropped(fgh):
+    scheduler = fgh.JobScheduler(0)
+    dropped = []
+    scheduler.schedule("job", 60, lambda: None, dropped=lambda: dropped.append("first"))
+    scheduler.schedule("job", 60, lambda: None, dropped=lambda: dropped.append("second"))
+    scheduler.cancel("job")
+    scheduler.cancel("job")
+    scheduler.stop()
+    assert dropped == ["first", "second"]
+
+
+def test_shutdown_backup_gives_up_on_running_backup(fgh, cloud, monkeypatch):
+    monkeypatch.setattr(fgh, "SHUTDOWN_BACKUP_WAIT", 0.05)
+    fgh.backup_lock.acquire()
+
+    fgh.shutdown_backup()
+
+    assert cloud.files == {}
+    fgh.backup_lock.release()
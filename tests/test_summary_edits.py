@@ -0,0 +1,43 @@
+import time
+from types import SimpleNamespace
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def register(fgh):
+    fgh.registered_channels["@canal"] = fgh.RegisteredChannel(
+        chat_id=-1001, template="Resumen", last_summary_message_id=5, summary_edit_window=0.05)
+
+
+def test_edits_resume_after_channel_is_registered_again(fgh):
+    edits = []
+    fgh.bot = SimpleNamespace(edit_message_text=lambda **kwargs: edits.append(kwargs["chat_id"]))
+    register(fgh)
+    fgh.summary_editor.mark_dirty("@canal")
+    fgh.registered_channels.pop("@canal")
+    # The edit's window ends with the channel gone
+    assert wait_for(lambda: "@canal" not in fgh.summary_editor.pending)
+    assert edits == []
+
+    register(fgh)
+    fgh.summary_editor.mark_dirty("@canal")
+
+    assert wait_for(lambda: edits == [-1001])
+    assert fgh.metrics.counters.get("summary_edits_saved", 0) == 0
+
+
+def test_dropped_edit_is_no_longer_pending(fgh):
+    register(fgh)
+    fgh.summary_editor.mark_dirty("@canal")
+    assert "@canal" in fgh.summary_editor.pending
+
+    fgh.scheduler.cancel("summary_edit:@canal")
+
+    assert "@canal" not in fgh.summary_editor.pending